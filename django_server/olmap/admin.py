@@ -3,7 +3,6 @@ from __future__ import annotations
 import datetime
 from typing import ClassVar
 
-from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
@@ -88,14 +87,18 @@ class OSMImageNoteAdmin(admin.ModelAdmin):
         if not image_note.image:
             return "No image."
         return mark_safe(
-            f'<img src="{settings.MEDIA_URL}{image_note.image}" '
-            f'style="max-width: calc(100vw-260px); max-height: 60vh"/>'
+            f'<a href="{image_note.image_url()}" target="_blank"><img src="{image_note.image_url("medium")}" '
+            f'style="max-width: calc(100vw-260px); max-height: 60vh"/></a>'
         )
 
     def image__(self, image_note):
         if not image_note.image:
             return "No image."
-        return mark_safe(f'<a href="{settings.MEDIA_URL}{image_note.image}" target="_blank">image</a>')
+        if "thumbnail" in image_note.image_sizes:
+            content = f'<img src="{image_note.image_url("thumbnail")}" style="max-height: 64px"/>'
+        else:
+            content = "image"
+        return mark_safe(f'<a href="{image_note.image_url()}" target="_blank">{content}</a>')
 
     def osm_edit(self, location):
         url = f"https://www.openstreetmap.org/edit#map=23/{location.lat}/{location.lon}"
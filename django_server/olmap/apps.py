@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class FvhCourierConfig(AppConfig):
     name = "olmap"
+
+    def ready(self):
+        # Connect the signal handlers keeping cached group memberships up to date:
+        from olmap.rest import permissions  # noqa: F401
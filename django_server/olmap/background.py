@@ -0,0 +1,29 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="olmap-background")
+
+
+def run_task(func, *args, **kwargs):
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        logger.exception(f"Background task {func.__name__} failed")
+    finally:
+        # Background threads get their own db connections, which would otherwise be left open:
+        connections.close_all()
+
+
+def run_in_background(func, *args, **kwargs):
+    """
+    Run func(*args, **kwargs) in a background thread of the current process, so that the current request need not
+    wait for it. When testing, run it right away instead, so that tests can check its results.
+    """
+    if getattr(settings, "TEST", False):
+        return func(*args, **kwargs)
+    return executor.submit(run_task, func, *args, **kwargs)
@@ -0,0 +1,17 @@
+import numpy as np
+
+from olmap.spatial import mean_earth_radius
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Return the great circle distance in meters between points given in degrees. The arguments may be numbers or
+    arrays, broadcast against each other as in NumPy, e.g. to get the distances from one point to many candidates
+    in a single call.
+
+    For the distances of up to a few kilometers used in linking, the result is within 0.5% of the geodesic distance
+    computed by geopy.
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=float)) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * mean_earth_radius * np.arcsin(np.sqrt(a))
@@ -0,0 +1,144 @@
+import os
+from io import BytesIO
+
+from django.core.files.storage import default_storage
+from PIL import ExifTags, Image, ImageOps
+
+# Maximum width and height in pixels of the downscaled derivatives generated of each image note image:
+derivative_sizes = {"thumbnail": 256, "medium": 1024, "full": 2048}
+
+# Pillow formats of JPEG images, MPO being JPEG with further images appended, as saved by many phones:
+jpeg_formats = ("JPEG", "MPO")
+
+
+def derivative_name(name, size):
+    """
+    Return the name of the given derivative of the image with the given name, stored next to the original.
+    """
+    return f"{os.path.splitext(name)[0]}_{size}.jpg"
+
+
+def derivative_urls(name, sizes):
+    """
+    Return {size: url} of the given derivatives of the image with the given name, or None if there are none.
+    """
+    if not (name and sizes):
+        return None
+    return {size: default_storage.url(derivative_name(name, size)) for size in sizes}
+
+
+def encode_jpeg(image, quality=75):
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    output = BytesIO()
+    image.save(output, format="JPEG", quality=quality)
+    return output.getvalue()
+
+
+def strip_jpeg_metadata(data):
+    """
+    Return the given JPEG data with its APP1 segments, which hold the EXIF and XMP metadata, removed without
+    re-encoding the image. Of MPO files, as saved by many phones, only the primary image is kept, as a plain JPEG.
+    Raise ValueError if the data is not a valid JPEG.
+    """
+    if data[:2] != b"\xff\xd8":
+        raise ValueError("Not a JPEG image")
+    output = bytearray(data[:2])
+    i = 2
+    while True:
+        if i + 1 >= len(data):
+            raise ValueError("Truncated JPEG")
+        if data[i] != 0xFF:
+            raise ValueError(f"Invalid JPEG marker at {i}")
+        marker = data[i + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker:
+            i += 1
+        elif marker == 0xD9:
+            output += data[i : i + 2]
+            break
+        elif marker == 0xDA:
+            # The compressed image data follows the start of scan up to the end of image, which cannot occur within
+            # it. Anything after it, e.g. the further images of an MPO file, is left out:
+            end = data.find(b"\xff\xd9", i)
+            if end == -1:
+                raise ValueError("Truncated JPEG")
+            output += data[i : end + 2]
+            break
+        elif 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            # Markers without a segment:
+            output += data[i : i + 2]
+            i += 2
+        else:
+            if i + 3 >= len(data):
+                raise ValueError("Truncated JPEG")
+            end = i + 2 + int.from_bytes(data[i + 2 : i + 4], "big")
+            if end > len(data):
+                raise ValueError("Truncated JPEG")
+            # The APP2 MPF segment indexes the further images of an MPO file:
+            if not (marker == 0xE1 or (marker == 0xE2 and data[i + 4 : i + 8] == b"MPF\x00")):
+                output += data[i:end]
+            i = end
+    return bytes(output)
+
+
+def normalized_image(data):
+    """
+    Given the data of an uploaded image, return (the data with the image rotated upright according to its EXIF
+    orientation and the EXIF data stripped, or None if there is no EXIF data to act on, the upright PIL image).
+
+    Only the image header is parsed to decide this. Images needing no rotation are not re-encoded, JPEGs having their
+    metadata removed losslessly instead, and the returned image is not decoded, so that derivatives can be decoded
+    from it at a reduced scale.
+    """
+    image = Image.open(BytesIO(data))
+    exif = image.getexif()
+    if not exif:
+        return None, image
+
+    if exif.get(ExifTags.Base.Orientation, 1) != 1:
+        image_format = image.format
+        image = ImageOps.exif_transpose(image)
+        if image_format == "PNG":
+            output = BytesIO()
+            image.save(output, format="PNG")
+            return output.getvalue(), image
+        # Saving without exif= leaves out the EXIF data, including any GPS position of the photographer:
+        return encode_jpeg(image), image
+
+    if image.format in jpeg_formats:
+        return strip_jpeg_metadata(data), image
+    output = BytesIO()
+    image.save(output, format=image.format)
+    return output.getvalue(), image
+
+
+def derivatives(image):
+    """
+    Yield (size, JPEG data) for each of the derivative_sizes of the given upright PIL image. A JPEG not yet decoded is
+    decoded only at the scale needed for the largest derivative, from which the smaller ones are then downscaled.
+    """
+    sizes = sorted(derivative_sizes.items(), key=lambda size: -size[1])
+    if image.format in jpeg_formats:
+        max_dimension = sizes[0][1]
+        scale = max_dimension / max(image.size)
+        if scale < 1:
+            image.draft("RGB", (round(image.size[0] * scale), round(image.size[1] * scale)))
+
+    encoded = {}
+    for size, max_dimension in sizes:
+        image = image.copy()
+        # Never upscales, so small images are just re-encoded:
+        image.thumbnail((max_dimension, max_dimension))
+        encoded[size] = encode_jpeg(image)
+    for size in derivative_sizes:
+        yield size, encoded[size]
+
+
+def replace_file(storage, name, content):
+    """
+    Store content under exactly the given name, replacing any existing file.
+    """
+    if storage.exists(name):
+        storage.delete(name)
+    storage.save(name, content)
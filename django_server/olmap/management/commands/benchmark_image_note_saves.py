@@ -0,0 +1,83 @@
+import time
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from PIL import ExifTags, Image
+
+from olmap.images import derivatives, encode_jpeg, normalized_image
+from olmap.models import OSMImageNote
+
+
+def legacy_save(note):
+    """
+    Save the note the way OSMImageNote.save did before images were processed in the background, when every save
+    re-read the whole image and scanned its EXIF data for the orientation.
+    """
+    with note.image.open("rb") as f:
+        image = Image.open(BytesIO(f.read()))
+    for orientation in ExifTags.TAGS:
+        if ExifTags.TAGS[orientation] == "Orientation":
+            break
+    exif = image._getexif()
+    if exif:
+        dict(exif.items()).get(orientation)
+    models.Model.save(note)
+
+
+def milliseconds(func, repeat):
+    start = time.perf_counter()
+    for _i in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the time taken by saving an image note with a large photo, as in review actions, and by processing "
+        "the photo, before and after processing was moved to the background. Makes no lasting changes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=20, help="Number of times to repeat each measurement.")
+        parser.add_argument("--width", type=int, default=4032, help="Width of the photo in pixels.")
+        parser.add_argument("--height", type=int, default=3024, help="Height of the photo in pixels.")
+
+    def photo(self, width, height):
+        image = Image.effect_noise((width, height), 64).convert("RGB")
+        exif = image.getexif()
+        exif[ExifTags.Base.Orientation] = 1
+        exif[ExifTags.Base.Make] = "Benchmark"
+        output = BytesIO()
+        image.save(output, format="JPEG", quality=90, exif=exif)
+        return output.getvalue()
+
+    def handle(self, *args, **options):
+        repeat = options["repeat"]
+        data = self.photo(options["width"], options["height"])
+        self.stdout.write(f"Photo of {options['width']}x{options['height']} pixels, {len(data) // 1024} KB:")
+
+        with transaction.atomic():
+            note = OSMImageNote.objects.create(lat=60.17, lon=24.94)
+            note.image.save("benchmark.jpg", ContentFile(data))
+            try:
+                results = {
+                    "review save, before": milliseconds(lambda: legacy_save(note), repeat),
+                    "review save, after": milliseconds(lambda: note.save(), repeat),
+                }
+            finally:
+                note.image.delete(save=False)
+                transaction.set_rollback(True)
+
+        def reencode():
+            image = Image.open(BytesIO(data))
+            encode_jpeg(image)
+            return image
+
+        results["processing without rotation, before"] = milliseconds(lambda: list(derivatives(reencode())), repeat)
+        results["processing without rotation, after"] = milliseconds(
+            lambda: list(derivatives(normalized_image(data)[1])), repeat
+        )
+        for name, ms in results.items():
+            self.stdout.write(f"{name}: {ms:.1f} ms")
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from olmap.rest.snapshots import FullGeoJSONSnapshot
+
+
+class Command(BaseCommand):
+    help = "Build the pre-rendered snapshot served as the full image notes geojson."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full", action="store_true", help="Render all notes rather than only those changed since the last build."
+        )
+
+    def handle(self, *args, **options):
+        snapshot = FullGeoJSONSnapshot().build_if_unlocked(full=options["full"])
+        if snapshot is None:
+            self.stdout.write("A snapshot is already being built, skipping.")
+            return
+        self.stdout.write(f"Built {snapshot.name} with {snapshot.count} image notes.")
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from olmap.images import derivative_sizes
+from olmap.models import OSMImageNote
+
+
+class Command(BaseCommand):
+    help = "Generate the downscaled derivatives of image note images uploaded before they were generated on upload."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Regenerate the derivatives of all images.")
+
+    def handle(self, *args, **options):
+        notes = OSMImageNote.objects.exclude(image="").exclude(image=None)
+        if not options["all"]:
+            notes = notes.exclude(image_sizes__contains=list(derivative_sizes))
+        note_ids = list(notes.order_by("id").values_list("id", flat=True))
+        for note_id in note_ids:
+            OSMImageNote.process_image(note_id)
+        failed = OSMImageNote.objects.filter(id__in=note_ids, image_status="failed").count()
+        self.stdout.write(f"Processed the images of {len(note_ids)} image notes, {failed} of which failed.")
@@ -0,0 +1,76 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from olmap.models.map_features import link_notes, map_feature_types
+from olmap.osm_sources import ExtractSource, OverpassSource
+from olmap.utils import PhaseTimer
+
+phases = ["fetch", "index", "match", "write"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Link map features to OSM nodes and their image notes to official addresses. By default only map features "
+        "saved since they were last checked are linked."
+    )
+
+    def add_arguments(self, parser):
+        type_names = [cls.__name__ for cls in map_feature_types]
+        parser.add_argument("--types", nargs="+", choices=type_names, help="Only link map features of these types.")
+        parser.add_argument(
+            "--since", help="Only link map features saved since this ISO 8601 time, whether checked before or not."
+        )
+        parser.add_argument("--all", action="store_true", help="Link all map features, not only those queued.")
+        parser.add_argument("--dry-run", action="store_true", help="Report the links found without writing them.")
+        parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes.")
+        parser.add_argument(
+            "--source",
+            choices=["overpass", "file"],
+            help="Where to read OSM nodes from. Defaults to OSM_EXTRACT if set, else Overpass.",
+        )
+        parser.add_argument("--file", help="The .osm.pbf or Overpass JSON extract to read with --source=file.")
+
+    def get_source(self, options):
+        if options["source"] == "overpass":
+            return OverpassSource(settings.OSM_CACHE_DIR, settings.OSM_CACHE_TTL)
+        if options["source"] == "file" or options["file"]:
+            path = options["file"] or settings.OSM_EXTRACT
+            if not path:
+                raise CommandError("--source=file requires --file or the OSM_EXTRACT setting.")
+            return ExtractSource(path)
+        # The source configured in settings:
+        return None
+
+    def parse_since(self, since):
+        if not since:
+            return None
+        parsed = parse_datetime(since)
+        if parsed is None:
+            raise CommandError(f"Invalid --since time: {since}")
+        return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+    def handle(self, *args, **options):
+        since = self.parse_since(options["since"])
+        feature_types = options["types"] and [cls for cls in map_feature_types if cls.__name__ in options["types"]]
+        timer = PhaseTimer()
+        osm_counts, address_counts = link_notes(
+            source=self.get_source(options),
+            workers=options["workers"],
+            incremental=not (options["all"] or since),
+            since=since,
+            dry_run=options["dry_run"],
+            feature_types=feature_types,
+            timer=timer,
+        )
+
+        would = "would be " if options["dry_run"] else ""
+        for type_name, counts in osm_counts.items():
+            line = f"{type_name}: {counts['linked']} {would}linked to OSM, {counts['skipped']} without a match"
+            if type_name in address_counts:
+                line += f", {address_counts[type_name]} notes {would}linked to official addresses"
+            self.stdout.write(line)
+        self.stdout.write(" ".join(f"{phase}: {timer.timings.get(phase, 0):.2f}s" for phase in phases))
@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from olmap.models import OSMImageNote
+
+
+class Command(BaseCommand):
+    help = (
+        "Process the images of image notes left pending, e.g. because the process processing them in the background "
+        "was restarted. Run periodically, e.g. from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--minutes",
+            type=int,
+            default=10,
+            help="Only process images of notes not modified for this many minutes, to leave recent uploads to the "
+            "background processing.",
+        )
+
+    def handle(self, *args, **options):
+        modified_before = timezone.now() - timedelta(minutes=options["minutes"])
+        notes = OSMImageNote.objects.filter(image_status="pending", modified_at__lt=modified_before)
+        note_ids = list(notes.order_by("id").values_list("id", flat=True))
+        for note_id in note_ids:
+            OSMImageNote.process_image(note_id)
+        failed = OSMImageNote.objects.filter(id__in=note_ids, image_status="failed").count()
+        self.stdout.write(f"Processed the pending images of {len(note_ids)} image notes, {failed} of which failed.")
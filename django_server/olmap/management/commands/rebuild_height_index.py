@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from olmap.models.map_features import update_height_limits
+
+
+class Command(BaseCommand):
+    help = "Recompute the height limits stored on image notes from their entrances, gates, passages and workplaces."
+
+    def handle(self, *args, **options):
+        changed = update_height_limits()
+        self.stdout.write(f"Updated the height limit of {changed} image notes.")
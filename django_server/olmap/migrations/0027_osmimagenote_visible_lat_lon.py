@@ -0,0 +1,16 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("olmap", "0026_auto_20220308_1304"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="osmimagenote",
+            index=models.Index(fields=["visible", "lat", "lon"], name="osmimagenote_visible_lat_lon"),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:31
+
+from django.db import migrations, models
+
+
+def forwards(apps, schema_editor):
+    OSMImageNote = apps.get_model("olmap", "OSMImageNote")
+
+    # In increasing order of precedence, as in olmap.models.map_features.height_limit_types:
+    height_fields = [("Entrance", "height"), ("Gate", "height"), ("BuildingPassage", "height")]
+    height_fields.append(("Workplace", "max_vehicle_height"))
+
+    index = {}
+    for model_name, field in height_fields:
+        Model = apps.get_model("olmap", model_name)
+        for image_note_id, height in Model.objects.filter(**{f"{field}__isnull": False}).values_list(
+            "image_note_id", field
+        ):
+            index[image_note_id] = height
+
+    notes = list(OSMImageNote.objects.filter(id__in=index.keys()).only("id"))
+    for note in notes:
+        note.height_limit = index[note.id]
+    OSMImageNote.objects.bulk_update(notes, ["height_limit"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("olmap", "0027_osmimagenote_visible_lat_lon"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="osmimagenote",
+            name="height_limit",
+            field=models.DecimalField(
+                blank=True,
+                decimal_places=2,
+                editable=False,
+                help_text="Max vehicle height in meters, maintained from the map features of the note",
+                max_digits=4,
+                null=True,
+            ),
+        ),
+        migrations.RunPython(forwards, lambda m, s: None),
+    ]
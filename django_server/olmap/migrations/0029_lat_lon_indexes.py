@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("olmap", "0028_osmimagenote_height_limit"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="address",
+            index=models.Index(fields=["lat", "lon"], name="address_lat_lon"),
+        ),
+        migrations.AddIndex(
+            model_name="osmimagenote",
+            index=models.Index(fields=["lat", "lon"], name="osmimagenote_lat_lon"),
+        ),
+    ]
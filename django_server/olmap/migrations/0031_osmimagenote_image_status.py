@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:55
+
+from django.db import migrations, models
+
+
+def forwards(apps, schema_editor):
+    # Images uploaded so far were processed synchronously on upload:
+    OSMImageNote = apps.get_model("olmap", "OSMImageNote")
+    OSMImageNote.objects.exclude(image="").exclude(image=None).update(image_status="ready")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("olmap", "0030_map_feature_link_queue"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="osmimagenote",
+            name="image_status",
+            field=models.CharField(
+                blank=True,
+                choices=[("pending", "pending"), ("ready", "ready"), ("failed", "failed")],
+                editable=False,
+                help_text="Pending until the orientation of the image is normalised and its EXIF data stripped",
+                max_length=16,
+                null=True,
+            ),
+        ),
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
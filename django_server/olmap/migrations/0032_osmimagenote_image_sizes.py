@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:57
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("olmap", "0031_osmimagenote_image_status"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="osmimagenote",
+            name="image_sizes",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.CharField(max_length=16),
+                blank=True,
+                default=list,
+                editable=False,
+                help_text="The downscaled derivatives generated of the image, see olmap.images.derivative_sizes",
+                size=None,
+            ),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("olmap", "0032_osmimagenote_image_sizes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Translation",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("source_hash", models.CharField(help_text="SHA-256 hex digest of the source text", max_length=64)),
+                ("language", models.CharField(help_text="Target language, e.g. en", max_length=16)),
+                ("translated_text", models.TextField()),
+                (
+                    "source_language",
+                    models.CharField(blank=True, help_text="Detected language of the source text", max_length=16),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(fields=("source_hash", "language"), name="translation_source_language")
+                ],
+            },
+        ),
+    ]
@@ -1,4 +1,4 @@
-from .base import Address
+from .base import Address, Translation
 from .map_features import (
     Barrier,
     BuildingPassage,
@@ -38,6 +38,7 @@ __all__ = [
     "OSMImageNoteComment",
     "OSMImageNoteCommentNotification",
     "Steps",
+    "Translation",
     "UnloadingPlace",
     "Workplace",
     "WorkplaceEntrance",
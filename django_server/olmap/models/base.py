@@ -38,6 +38,26 @@ class Address(TimestampedModel):
     class Meta:
         verbose_name = _("address")
         verbose_name_plural = _("addresses")
+        indexes = [
+            # Supports radius lookups in olmap.spatial:
+            models.Index(fields=["lat", "lon"], name="address_lat_lon")
+        ]
 
     def __str__(self):
         return f"{self.street} {self.housenumber}"
+
+
+class Translation(Model):
+    """
+    A stored machine translation of a text, looked up by a hash of the text and the target language, so that each
+    text is sent to the translation backend only once per language. See olmap.translation.
+    """
+
+    source_hash = models.CharField(max_length=64, help_text="SHA-256 hex digest of the source text")
+    language = models.CharField(max_length=16, help_text="Target language, e.g. en")
+    translated_text = models.TextField()
+    source_language = models.CharField(max_length=16, blank=True, help_text="Detected language of the source text")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["source_hash", "language"], name="translation_source_language")]
@@ -1,24 +1,24 @@
-from time import sleep
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy as np
 import overpy
+import shapely
 from django.contrib.postgres.fields import ArrayField
 from django.core.validators import RegexValidator
-from geopy.distance import distance
-from overpy.exception import OverpassTooManyRequests
+from django.db import connections, models, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from shapely.strtree import STRtree
 
-try:
-    from shapely.geometry import Point
-    from shapely.strtree import STRtree
-except (ImportError, OSError):
-    pass
-
-from django.db import models
-
-from olmap.utils import intersection_matches
+from olmap.distance import haversine
+from olmap.osm_sources import get_osm_source, node_as_json
+from olmap.translation import pretranslate_on_commit
+from olmap.utils import PhaseTimer, intersection_matches
 
 from . import Address
 from .base import Model
-from .osm_image_notes import OSMFeature, OSMImageNote
+from .osm_image_notes import OSMFeature, OSMImageNote, touch_image_notes
 
 
 def dimension_field():
@@ -41,30 +41,27 @@ def bool_to_osm(b):
     return {True: "yes", False: "no", None: None}[b]
 
 
-class FeatureIndex:
-    def __init__(self, features):
-        if not len(features):
-            self.index = {}
-        self.index = {self.get_id(feature): feature for feature in features}
-
-    def is_linked(self, image_note):
-        return any(self.index.get(node.id, None) for node in self.note_features(image_note))
-
-
-class OSMFeatureIndex(FeatureIndex):
-    def get_id(self, feature):
-        return feature.id
+def normalize_street(street):
+    return " ".join(street.split()).lower()
 
-    def note_features(self, note):
-        return note.osm_features.all()
 
+def normalize_housenumber(housenumber):
+    """
+    Return the housenumber as a join key ignoring case and whitespace, e.g. "12 B" -> "12b".
+    """
+    return "".join(housenumber.split()).lower()
 
-class AddressIndex(FeatureIndex):
-    def get_id(self, feature):
-        return feature["id"]
 
-    def note_features(self, note):
-        return note.addresses.all()
+def housenumber_keys(housenumber):
+    """
+    Return the join keys to try for an address with the given housenumber in order of preference: the whole
+    housenumber and then, for ranges such as 3-5, each end of the range.
+    """
+    key = normalize_housenumber(housenumber)
+    keys = [key]
+    if "-" in key:
+        keys += [part for part in key.split("-") if part]
+    return keys
 
 
 class MapFeature(models.Model):
@@ -75,58 +72,179 @@ class MapFeature(models.Model):
     osm_node_query = None
     required_osm_matching_tags = []
     max_distance_to_osm_node = 5
+    # Search radius for candidate nodes in degrees, roughly 30 m:
+    osm_node_search_radius = 0.0003
+
+    # Override in subclasses whose field limits the vehicle height at the image note:
+    height_limit_field = None
+
+    # Override in subclasses with text fields to translate in the background when saved, see olmap.translation:
+    translated_fields = []
+
+    # Instances saved since they were last checked by the automatic linkers are queued for linking, see link_queue:
+    modified_at = models.DateTimeField(auto_now=True, null=True)
+    link_checked_at = models.DateTimeField(blank=True, null=True, editable=False)
 
     class Meta:
         abstract = True
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if cls.height_limit_field in field_names:
+            # Kept to tell whether saving the instance changes the height limit of its note:
+            instance._loaded_height_limit = getattr(instance, cls.height_limit_field)
+        return instance
+
+    def save(self, **kwargs):
+        height_limit_changed = self.height_limit_changed(kwargs.get("update_fields", None))
+        ret = super().save(**kwargs)
+        self.image_notes_changed([self.image_note_id], height_limit_changed)
+        if self.height_limit_field:
+            self._loaded_height_limit = getattr(self, self.height_limit_field)
+        pretranslate_on_commit([self])
+        return ret
+
+    @classmethod
+    def new_image_note(cls, **fields):
+        """
+        Return a new unsaved image note for a map feature of this type created on its own, e.g. in the workplace
+        wizard, rather than from an image note.
+        """
+        return OSMImageNote(tags=[cls.__name__], **fields)
+
+    def delete(self, **kwargs):
+        height_limit_changed = bool(self.height_limit_field) and getattr(self, self.height_limit_field) is not None
+        ret = super().delete(**kwargs)
+        self.image_notes_changed([self.image_note_id], height_limit_changed)
+        return ret
+
+    def height_limit_changed(self, update_fields=None):
+        """
+        Return whether saving this instance, optionally only the given update_fields, may change the height limit of
+        its image note, i.e. whether its height limit field was set when created or changed since loaded.
+        """
+        field_name = self.height_limit_field
+        if not field_name or (update_fields is not None and field_name not in update_fields):
+            return False
+        value = self._meta.get_field(field_name).to_python(getattr(self, field_name))
+        if self._state.adding:
+            return value is not None
+        return not hasattr(self, "_loaded_height_limit") or value != self._loaded_height_limit
+
+    @classmethod
+    def image_notes_changed(cls, image_note_ids, height_limit_changed=True):
+        """
+        Update the given image notes after map features of this type attached to them were saved or deleted, also
+        recomputing their height limits if the height limit field of the features may have changed.
+        """
+        touch_image_notes(image_note_ids)
+        if cls.height_limit_field and height_limit_changed:
+            update_height_limits(image_note_ids)
+
     def as_osm_tags(self):
         return {}
 
     @classmethod
-    def link_notes_to_osm_objects(cls):
-        if not (cls.osm_node_query and len(cls.required_osm_matching_tags)):
-            return
-        api = overpy.Overpass()
-
-        query = f"""
-        [out:json][timeout:25];
-        node[{cls.osm_node_query}](area:3600034914)->.nodes;
-        .nodes out;
+    def link_queue(cls):
+        """
+        Return the instances saved since they were last checked by the automatic linkers.
+        """
+        return cls.objects.filter(Q(link_checked_at=None) | Q(link_checked_at__lt=F("modified_at")))
+
+    @classmethod
+    def link_candidates(cls, incremental=False, since=None):
+        """
+        Return the instances to consider for automatic linking: those in the link queue if incremental, else all,
+        optionally limited to those saved since the given time.
+        """
+        instances = cls.link_queue() if incremental else cls.objects.all()
+        return instances.filter(modified_at__gte=since) if since else instances
+
+    @classmethod
+    def fetch_osm_nodes(cls, source=None):
+        """
+        Return the OSM nodes matching osm_node_query from the given OSM source, by default the one in settings.
+        """
+        return (source or get_osm_source()).nodes(cls.osm_node_query)
+
+    @classmethod
+    def links_to_osm_nodes(cls):
+        return bool(cls.osm_node_query and len(cls.required_osm_matching_tags))
+
+    @classmethod
+    def link_notes_to_osm_objects(
+        cls, batch_size=1000, source=None, nodes=None, incremental=False, since=None, dry_run=False, timer=None
+    ):
+        """
+        Link instances not yet linked to OSM to matching OSM nodes near their image notes, writing the links in bulk.
+        Nodes are matched among the given nodes, or else read from the given OSM source, by default the one in
+        settings. The instances considered are selected by link_candidates(incremental, since). With dry_run, the
+        matches are counted but not written. Time spent is recorded in the given PhaseTimer. Return the numbers of
+        instances linked and skipped, i.e. left without a match.
+        """
+        if not cls.links_to_osm_nodes():
+            return {"linked": 0, "skipped": 0}
+        timer = timer or PhaseTimer()
+
+        if nodes is None:
+            with timer.phase("fetch"):
+                nodes = cls.fetch_osm_nodes(source)
+        with timer.phase("index"):
+            instances = cls.link_candidates(incremental, since).filter(osm_feature=None).select_related("image_note")
+            instances = list(instances)
+            if not (nodes and instances):
+                return {"linked": 0, "skipped": len(instances)}
+            note_positions = np.array([[i.image_note.lat, i.image_note.lon] for i in instances], dtype=float)
+            node_positions = np.array([[node.lat, node.lon] for node in nodes], dtype=float)
+            tree = STRtree(shapely.points(node_positions))
+
+        with timer.phase("match"):
+            note_indices, node_indices, distances = cls.osm_node_candidates(note_positions, node_positions, tree)
+            bounds = np.searchsorted(note_indices, np.arange(len(instances) + 1))
+            matches = []
+            for i, instance in enumerate(instances):
+                candidates = slice(bounds[i], bounds[i + 1])
+                node = instance.match_osm_node(nodes, node_indices[candidates], distances[candidates])
+                if node:
+                    matches.append((instance, node.id))
+
+        if not dry_run:
+            with timer.phase("write"):
+                bulk_link_osm_ids(cls, matches, batch_size)
+        return {"linked": len(matches), "skipped": len(instances) - len(matches)}
+
+    @classmethod
+    def osm_node_candidates(cls, note_positions, node_positions, tree=None):
+        """
+        Return the candidate OSM nodes of each note, given [lat, lon] arrays of the note and node positions and
+        optionally an STRtree of the nodes, as arrays (note indices, node indices, distances in meters) sorted by
+        note and then by distance. The candidates of a note are its nearest node and any others within
+        osm_node_search_radius, found in bulk queries.
+        """
+        if tree is None:
+            tree = STRtree(shapely.points(node_positions))
+        points = shapely.points(note_positions)
+        nearest = tree.query_nearest(points, all_matches=False)
+        nearby = tree.query(points, predicate="dwithin", distance=cls.osm_node_search_radius)
+        note_indices, node_indices = np.unique(np.concatenate([nearest, nearby], axis=1), axis=1)
+        distances = haversine(*note_positions[note_indices].T, *node_positions[node_indices].T)
+        order = np.lexsort((distances, note_indices))
+        return note_indices[order], node_indices[order], distances[order]
+
+    def match_osm_node(self, nodes, candidates, distances):
         """
-        try:
-            result = api.query(query)
-        except OverpassTooManyRequests:
-            sleep(30)
-            result = api.query(query)
-
-        points = []
-        for node in result.nodes:
-            p = Point(node.lat, node.lon)
-            p.node = node
-            points.append(p)
-        tree = STRtree(points)
-
-        instances = cls.objects.filter(osm_feature=None).prefetch_related("image_note__osm_features")
-        linked_count = 0
-        for instance in instances:
-            note_position = [instance.image_note.lat, instance.image_note.lon]
-            nearest_osm = tree.nearest(Point(*note_position)).node
-            dst = distance([nearest_osm.lat, nearest_osm.lon], note_position).meters
-            tags = instance.as_osm_tags()
-            matches = intersection_matches(nearest_osm.tags, tags, *cls.required_osm_matching_tags)
-            if matches and dst < cls.max_distance_to_osm_node:
-                instance.link_osm_id(nearest_osm.id)
-                linked_count += 1
-            else:
-                for point in tree.query(Point(*note_position).buffer(0.0003)):
-                    node = point.node
-                    dst = distance([node.lat, node.lon], note_position).meters
-                    tags = instance.as_osm_tags()
-                    matches = intersection_matches(node.tags, tags, *cls.required_osm_matching_tags)
-                    if matches and dst < cls.max_distance_to_osm_node:
-                        instance.link_osm_id(node.id)
-                        linked_count += 1
-                        break
+        Return the first OSM node matching this instance among the candidate nodes, given as indices into nodes
+        along with their distances in meters, or None.
+        """
+        tags = self.as_osm_tags()
+        for i, dst in zip(candidates, distances, strict=True):
+            if dst >= self.max_distance_to_osm_node:
+                break
+            node = nodes[i]
+            if intersection_matches(node.tags, tags, *self.required_osm_matching_tags):
+                return node
+        return None
 
     def link_osm_id(self, osm_id):
         feature = OSMFeature.objects.get_or_create(id=osm_id)[0]
@@ -149,6 +267,9 @@ class BaseAddress(MapFeature):
     housenumber = models.CharField(max_length=8, blank=True, null=True, help_text="E.g. 3-5")
     unit = models.CharField(max_length=8, blank=True)
 
+    # For automatic linking of official addresses to image notes:
+    max_distance_to_address = 150
+
     class Meta:
         abstract = True
 
@@ -159,30 +280,63 @@ class BaseAddress(MapFeature):
         )
 
     @classmethod
-    def link_notes_to_official_address(cls):
-        addresses = Address.objects.filter(city="Helsinki").values()
-        address_id_index = AddressIndex(addresses)
-        address_index = {f"{a['street']} {a['housenumber']}": a for a in addresses}
+    def link_notes_to_official_address(cls, batch_size=1000, incremental=False, since=None, dry_run=False, timer=None):
+        """
+        Link the image notes of instances to the official Helsinki address matching the street and housenumber of
+        the instance, if within max_distance_to_address of the note. Notes already linked to a Helsinki address are
+        skipped and the instances considered are selected by link_candidates(incremental, since). With dry_run, the
+        links are counted but not written. Time spent is recorded in the given PhaseTimer. Return the number of notes
+        linked.
+        """
+        timer = timer or PhaseTimer()
+        with timer.phase("fetch"):
+            addresses = Address.objects.filter(city="Helsinki", lat__isnull=False, lon__isnull=False)
+            addresses = list(addresses.values_list("id", "street", "housenumber", "lat", "lon"))
+            instances = list(
+                cls.link_candidates(incremental, since)
+                .filter(housenumber__isnull=False, street__isnull=False)
+                .exclude(image_note__addresses__city="Helsinki")
+                .values_list("image_note_id", "street", "housenumber", "image_note__lat", "image_note__lon")
+            )
 
-        instances = cls.objects.prefetch_related("image_note__addresses").filter(
-            housenumber__isnull=False, street__isnull=False
-        )
-        linked_count = 0
-        for instance in instances:
-            housenumbers = [instance.housenumber]
-            if "-" in instance.housenumber:
-                housenumbers = housenumbers + [s.strip() for s in instance.housenumber.split("-")]
-            for housenumber in housenumbers:
-                street_address = f"{instance.street} {housenumber}"
-                address = address_index.get(street_address)
-                if (not address) or address_id_index.is_linked(instance.image_note):
-                    continue
-                note_position = [instance.image_note.lat, instance.image_note.lon]
-                dst = distance(note_position, [address["lat"], address["lon"]]).meters
-                if dst < 150:
-                    added = instance.image_note.addresses.add(address["id"])
-                    if added:
-                        linked_count += 1
+        with timer.phase("index"):
+            address_index = {}
+            for address_id, street, housenumber, lat, lon in addresses:
+                if housenumber:
+                    key = (normalize_street(street), normalize_housenumber(housenumber))
+                    address_index.setdefault(key, (address_id, lat, lon))
+
+        with timer.phase("match"):
+            # Join the instances to the addresses, collecting the candidates of each in order of preference:
+            candidates = []
+            for note_id, street, housenumber, lat, lon in instances:
+                street = normalize_street(street)
+                for key in housenumber_keys(housenumber):
+                    address = address_index.get((street, key))
+                    if address:
+                        candidates.append((note_id, lat, lon, *address))
+            if not candidates:
+                return 0
+
+            note_ids, note_lats, note_lons, address_ids, address_lats, address_lons = zip(*candidates, strict=True)
+            distances = haversine(note_lats, note_lons, address_lats, address_lons)
+
+            links = {}
+            for note_id, address_id, dst in zip(note_ids, address_ids, distances, strict=True):
+                if dst < cls.max_distance_to_address:
+                    links.setdefault(note_id, address_id)
+
+        if not dry_run:
+            with timer.phase("write"):
+                Link = OSMImageNote.addresses.through
+                with transaction.atomic():
+                    Link.objects.bulk_create(
+                        [Link(osmimagenote_id=note_id, address_id=address_id) for note_id, address_id in links.items()],
+                        batch_size=batch_size,
+                        ignore_conflicts=True,
+                    )
+                    touch_image_notes(list(links))
+        return len(links)
 
 
 class WithLayer(MapFeature):
@@ -193,11 +347,19 @@ class WithLayer(MapFeature):
 
     def save(self, **kwargs):
         ret = super().save(**kwargs)
-        if self.layer and (self.image_note.layer != self.layer):
-            self.image_note.layer = self.layer
+        if self.copy_layer_to_note():
             self.image_note.save()
         return ret
 
+    def copy_layer_to_note(self):
+        """
+        Set the layer of the image note to the layer of this feature, if given. Return whether the note changed.
+        """
+        if self.layer and (self.image_note.layer != self.layer):
+            self.image_note.layer = self.layer
+            return True
+        return False
+
 
 class Lockable(WithLayer):
     accesses = ["yes", "private", "delivery", "no"]
@@ -209,6 +371,8 @@ class Lockable(WithLayer):
     phone = models.CharField(blank=True, max_length=32)
     opening_hours = models.CharField(blank=True, max_length=256, help_text="E.g. Mo-Fr 08:00-12:00; Sa 10:00-12:00")
 
+    height_limit_field = "height"
+
     class Meta:
         abstract = True
 
@@ -334,6 +498,9 @@ class Workplace(BaseAddress):
     delivery_instructions = models.TextField(blank=True)
     max_vehicle_height = dimension_field()
 
+    height_limit_field = "max_vehicle_height"
+    translated_fields = ["delivery_instructions"]
+
     # For automatic linking of OSM nodes to OLMap instances:
     osm_node_query = "name"
     required_osm_matching_tags = ["name"]
@@ -364,6 +531,8 @@ class WorkplaceEntrance(Model):
     delivery_hours = models.CharField(blank=True, max_length=64, help_text="E.g. Mo-Fr 08:00-12:00; Sa 10:00-12:00")
     delivery_instructions = models.TextField(blank=True)
 
+    translated_fields = ["delivery_instructions", "description"]
+
     def image_note(self):
         return self.entrance.image_note
 
@@ -372,11 +541,30 @@ class WorkplaceEntrance(Model):
 
     def save(self, **kwargs):
         ret = super().save(**kwargs)
-        if self.description and self.workplace.name and not self.entrance.description:
-            self.entrance.description = f"{self.description}, {self.workplace.name}"
+        if self.describe_entrance():
             self.entrance.save()
+        touch_image_notes(self.image_note_ids())
+        pretranslate_on_commit([self])
+        return ret
+
+    def delete(self, **kwargs):
+        ret = super().delete(**kwargs)
+        touch_image_notes(self.image_note_ids())
         return ret
 
+    def image_note_ids(self):
+        return {self.workplace.image_note_id, self.entrance.image_note_id}
+
+    def describe_entrance(self):
+        """
+        Describe the entrance by the description of this workplace entrance and the workplace name, unless already
+        described. Return whether the entrance changed.
+        """
+        if self.description and self.workplace.name and not self.entrance.description:
+            self.entrance.description = f"{self.description}, {self.workplace.name}"
+            return True
+        return False
+
 
 class UnloadingPlace(WithLayer):
     length = dimension_field()
@@ -387,6 +575,8 @@ class UnloadingPlace(WithLayer):
     entrances = models.ManyToManyField(to=Entrance, related_name="unloading_places", blank=True)
     access_points = models.JSONField(default=list, blank=True)
 
+    translated_fields = ["description"]
+
     def as_osm_tags(self):
         return filter_dict(
             {
@@ -428,6 +618,8 @@ class BuildingPassage(MapFeature):
     width = dimension_field()
     height = dimension_field()
 
+    height_limit_field = "height"
+
     def as_osm_tags(self):
         return filter_dict(
             {
@@ -441,17 +633,252 @@ class BuildingPassage(MapFeature):
 
 map_feature_types = [Entrance, Steps, Gate, Barrier, Workplace, InfoBoard, TrafficSign, UnloadingPlace, BuildingPassage]
 address_feature_types = [Entrance, Workplace]
+# In increasing order of precedence when a note has several height limits:
+height_limit_types = [Entrance, Gate, BuildingPassage, Workplace]
 
 
 def manager_name(prop_type):
     return prop_type.__name__.lower() + "_set"
 
 
-def link_notes_to_osm_objects():
-    for cls in map_feature_types:
-        cls.link_notes_to_osm_objects()
+def bulk_link_osm_ids(feature_type, matches, batch_size=1000):
+    """
+    Link map features of the given type to OSM nodes, given matches as a list of (instance, osm_id). Creates any
+    missing OSMFeatures, adds them to the image notes of the instances and sets the osm_feature of the instances,
+    all using bulk writes.
+    """
+    if not matches:
+        return
+    note_links = {(instance.image_note_id, osm_id) for instance, osm_id in matches}
+    Link = OSMImageNote.osm_features.through
+    with transaction.atomic():
+        OSMFeature.objects.bulk_create(
+            [OSMFeature(id=osm_id) for osm_id in {osm_id for _, osm_id in matches}],
+            ignore_conflicts=True,
+            batch_size=batch_size,
+        )
+        Link.objects.bulk_create(
+            [Link(osmimagenote_id=note_id, osmfeature_id=osm_id) for note_id, osm_id in note_links],
+            ignore_conflicts=True,
+            batch_size=batch_size,
+        )
+        for instance, osm_id in matches:
+            instance.osm_feature_id = osm_id
+        feature_type.objects.bulk_update([instance for instance, _ in matches], ["osm_feature"], batch_size=batch_size)
+        touch_image_notes({note_id for note_id, _ in note_links})
+
+
+def save_image_note_map_features(image_note, fields_by_type):
+    """
+    Make the map features of the given image note match fields_by_type, {map feature type: list of field dicts},
+    where dicts with an id update the existing instance and the others create new ones. Instances of the given types
+    not in the lists are deleted. The existing instances of each type are read in a single query and written using
+    bulk writes in one transaction, with the side effects of MapFeature.save applied once for the note.
+
+    Return {map feature type: list of the resulting instances, ordered by id}.
+    """
+    now = timezone.now()
+    results = {}
+    changed_types = []
+    layers = []
+    with transaction.atomic():
+        for feature_type, fields_list in fields_by_type.items():
+            existing = {f.id: f for f in feature_type.objects.filter(image_note=image_note)}
+            m2m_names = {field.name for field in feature_type._meta.many_to_many}
+            updated, created, m2m_values = [], [], []
+            update_fields = {"modified_at"}
+            for fields in fields_list:
+                fields = dict(fields)
+                m2m = {name: fields.pop(name) for name in m2m_names & fields.keys()}
+                feature_id = fields.pop("id", None)
+                if feature_id:
+                    if feature_id not in existing:
+                        raise feature_type.DoesNotExist(f"No {feature_type.__name__} {feature_id} in this image note.")
+                    feature = existing.pop(feature_id)
+                    for k, v in fields.items():
+                        setattr(feature, k, v)
+                    feature.modified_at = now
+                    update_fields.update(fields.keys())
+                    updated.append(feature)
+                else:
+                    feature = feature_type(image_note=image_note, **fields)
+                    created.append(feature)
+                m2m_values.append((feature, m2m))
+                layers.append(getattr(feature, "layer", None))
+
+            if existing:
+                feature_type.objects.filter(id__in=existing.keys()).delete()
+            if updated:
+                feature_type.objects.bulk_update(updated, update_fields)
+            if created:
+                feature_type.objects.bulk_create(created)
+            for feature, m2m in m2m_values:
+                for name, values in m2m.items():
+                    getattr(feature, name).set(values)
+            if existing or updated or created:
+                changed_types.append(feature_type)
+            pretranslate_on_commit(updated + created)
+            results[feature_type] = sorted(updated + created, key=lambda f: f.id)
+
+        # As in WithLayer.save, the last given layer is the layer of the note:
+        layer = next((layer for layer in reversed(layers) if layer), None)
+        if layer and layer != image_note.layer:
+            image_note.layer = layer
+            image_note.save(update_fields=["layer"])
+        if changed_types:
+            touch_image_notes([image_note.id])
+            if any(feature_type.height_limit_field for feature_type in changed_types):
+                update_height_limits([image_note.id])
+                # So that saving the note afterwards keeps the new height limit:
+                image_note.refresh_from_db(fields=["height_limit"])
+    return results
+
+
+def link_feature_type_to_osm_nodes(feature_type, elements, options):
+    """
+    Link map features of the given type to the OSM nodes in elements, given in the Overpass JSON format so that they
+    can be passed to worker processes, with the keyword arguments in options. Return (the counts of
+    link_notes_to_osm_objects, the timings of its phases).
+    """
+    timer = PhaseTimer()
+    with timer.phase("index"):
+        nodes = overpy.Result.from_json({"elements": elements}).nodes
+    counts = feature_type.link_notes_to_osm_objects(nodes=nodes, timer=timer, **options)
+    return counts, timer.timings
+
+
+def link_notes_to_osm_objects(
+    source=None, workers=1, incremental=False, since=None, dry_run=False, feature_types=None, timer=None
+):
+    """
+    Link map features of the given types, by default all, to matching OSM nodes from the given OSM source, by
+    default the one in settings. The nodes of all types are fetched in a single pass and the types then linked in up
+    to the given number of worker processes. If no instances are to be considered, OSM is not accessed at all. See
+    MapFeature.link_notes_to_osm_objects for the other arguments. Return {type name: {"linked": n, "skipped": n}}.
+    """
+    timer = timer or PhaseTimer()
+    feature_types = feature_types or map_feature_types
+    counts = {cls.__name__: {"linked": 0, "skipped": 0} for cls in feature_types}
+    with timer.phase("index"):
+        feature_types = [
+            cls
+            for cls in feature_types
+            if cls.links_to_osm_nodes() and cls.link_candidates(incremental, since).filter(osm_feature=None).exists()
+        ]
+    if not feature_types:
+        return counts
+
+    with timer.phase("fetch"):
+        nodes = (source or get_osm_source()).nodes_by_filter([cls.osm_node_query for cls in feature_types])
+    options = {"incremental": incremental, "since": since, "dry_run": dry_run}
+    jobs = [(cls, [node_as_json(node) for node in nodes[cls.osm_node_query]], options) for cls in feature_types]
+
+    if workers > 1 and len(jobs) > 1:
+        # Forked workers must not share the db connections of this process:
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), mp_context=context) as executor:
+            results = list(executor.map(link_feature_type_to_osm_nodes, *zip(*jobs, strict=True)))
+    else:
+        results = [link_feature_type_to_osm_nodes(*job) for job in jobs]
+
+    for (cls, elements, options), (type_counts, timings) in zip(jobs, results, strict=True):
+        counts[cls.__name__] = type_counts
+        # With several workers the phases of different types overlap, so this is the total time across workers:
+        timer.merge(timings)
+    return counts
+
+
+def link_notes_to_official_address(incremental=False, since=None, dry_run=False, feature_types=None, timer=None):
+    """
+    Link the image notes of map features of the given types with addresses, by default all, to official addresses.
+    See BaseAddress.link_notes_to_official_address for the arguments. Return {type name: notes linked}.
+    """
+    options = {"incremental": incremental, "since": since, "dry_run": dry_run, "timer": timer}
+    feature_types = [cls for cls in address_feature_types if cls in (feature_types or address_feature_types)]
+    return {cls.__name__: cls.link_notes_to_official_address(**options) for cls in feature_types}
+
+
+def link_queue_versions(feature_types=None, since=None):
+    """
+    Return {map feature type: list of (id, modified_at)} of the map features of the given types, by default all, in
+    the link queue, optionally limited to those saved since the given time.
+    """
+    versions = {}
+    for cls in feature_types or map_feature_types:
+        queued = cls.link_queue()
+        queued = queued.filter(modified_at__gte=since) if since else queued
+        versions[cls] = list(queued.values_list("id", "modified_at"))
+    return versions
+
+
+def mark_link_checked(versions, checked_at, batch_size=1000):
+    """
+    Remove the map features in versions, as returned by link_queue_versions before the linkers read their candidates,
+    from the link queue. Each is marked checked as of the version read, so that features saved again since then, or
+    committed only after the linkers read them, stay queued.
+    """
+    for cls, instances in versions.items():
+        cls.objects.bulk_update(
+            [cls(id=id, link_checked_at=modified_at or checked_at) for id, modified_at in instances],
+            ["link_checked_at"],
+            batch_size=batch_size,
+        )
 
 
-def link_notes_to_official_address():
-    for cls in address_feature_types:
-        cls.link_notes_to_official_address()
+def link_notes(source=None, workers=1, incremental=False, since=None, dry_run=False, feature_types=None, timer=None):
+    """
+    Link map features to OSM nodes and official addresses and then, unless dry_run, remove the checked features
+    from the link queue. See link_notes_to_osm_objects for the arguments. Return the counts of
+    link_notes_to_osm_objects and link_notes_to_official_address.
+    """
+    started_at = timezone.now()
+    # Read before the linkers, so that only features they have seen are removed from the queue:
+    versions = {} if dry_run else link_queue_versions(feature_types, since)
+    options = {"incremental": incremental, "since": since, "dry_run": dry_run, "feature_types": feature_types}
+    osm_counts = link_notes_to_osm_objects(source, workers, timer=timer, **options)
+    address_counts = link_notes_to_official_address(timer=timer, **options)
+    if not dry_run:
+        with (timer or PhaseTimer()).phase("write"):
+            mark_link_checked(versions, started_at)
+    return osm_counts, address_counts
+
+
+def height_index(image_note_ids=None):
+    """
+    Return a dict {image_note_id: height} for height limitations on workplaces, entrances, gates and building passages,
+    optionally limited to the given image notes.
+    """
+    index = {}
+    for feature_type in height_limit_types:
+        features = feature_type.objects.filter(**{f"{feature_type.height_limit_field}__isnull": False})
+        if image_note_ids is not None:
+            features = features.filter(image_note_id__in=image_note_ids)
+        for i in features.values_list("image_note_id", feature_type.height_limit_field):
+            index[i[0]] = i[1]
+    return index
+
+
+def update_height_limits(image_note_ids=None):
+    """
+    Store the height limits of the given image notes, or of all notes if None, in OSMImageNote.height_limit.
+    Return the number of notes whose height limit changed.
+    """
+    index = height_index(image_note_ids)
+    notes = OSMImageNote.objects.only("id", "height_limit")
+    if image_note_ids is not None:
+        notes = notes.filter(id__in=image_note_ids)
+    else:
+        notes = notes.filter(models.Q(height_limit__isnull=False) | models.Q(id__in=index.keys()))
+
+    now = timezone.now()
+    changed = []
+    for note in notes:
+        height_limit = index.get(note.id, None)
+        if note.height_limit != height_limit:
+            note.height_limit = height_limit
+            # Changing the height limit changes the note as seen by API clients:
+            note.modified_at = now
+            changed.append(note)
+    OSMImageNote.objects.bulk_update(changed, ["height_limit", "modified_at"], batch_size=1000)
+    return len(changed)
@@ -1,15 +1,26 @@
-from io import BytesIO
+import logging
 
 from django.contrib.auth.models import User
 from django.contrib.postgres.fields import ArrayField
-from django.core.files import File
-from django.db import models
-from PIL import ExifTags, UnidentifiedImageError
-from PIL import Image as Img
+from django.core.files.base import ContentFile
+from django.db import models, transaction
+from django.utils import timezone
+
+from olmap.background import run_in_background
+from olmap.images import derivative_name, derivatives, normalized_image, replace_file
 
 from . import base
 from .base import Address, TimestampedModel
 
+logger = logging.getLogger(__name__)
+
+
+def touch_image_notes(image_note_ids):
+    """
+    Mark the given image notes as modified, so that clients see a new version of them.
+    """
+    OSMImageNote.objects.filter(id__in=image_note_ids).update(modified_at=timezone.now())
+
 
 class OSMFeature(base.Model):
     id = models.BigIntegerField(primary_key=True)
@@ -57,45 +68,93 @@ class OSMImageNote(TimestampedModel):
         blank=True, help_text="If reviewer decides to hide the note, document reason here."
     )
     layer = models.IntegerField(blank=True, null=True, help_text="Map layer, e.g. -1 if underground")
+    image_status = models.CharField(
+        max_length=16,
+        blank=True,
+        null=True,
+        editable=False,
+        choices=[(status, status) for status in ["pending", "ready", "failed"]],
+        help_text="Pending until the orientation of the image is normalised and its EXIF data stripped",
+    )
+    image_sizes = ArrayField(
+        base_field=models.CharField(max_length=16),
+        default=list,
+        blank=True,
+        editable=False,
+        help_text="The downscaled derivatives generated of the image, see olmap.images.derivative_sizes",
+    )
+    height_limit = models.DecimalField(
+        max_digits=4,
+        decimal_places=2,
+        blank=True,
+        null=True,
+        editable=False,
+        help_text="Max vehicle height in meters, maintained from the map features of the note",
+    )
+
+    class Meta:
+        indexes = [
+            # Supports limiting the visible notes to a map viewport:
+            models.Index(fields=["visible", "lat", "lon"], name="osmimagenote_visible_lat_lon"),
+            # Supports radius lookups in olmap.spatial:
+            models.Index(fields=["lat", "lon"], name="osmimagenote_lat_lon"),
+        ]
 
     def __str__(self):
         return self.comment or super().__str__()
 
     def save(self, *args, **kwargs):
-        if not self.image:
-            return super().save(*args, **kwargs)
-
+        # Images are processed in the background after upload, so that uploading large photos stays fast:
+        image_uploaded = bool(self.image) and not self.image._committed
+        if image_uploaded:
+            self.image_status = "pending"
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = {*kwargs["update_fields"], "image_status"}
+        ret = super().save(*args, **kwargs)
+        if image_uploaded:
+            note_id = self.id
+            transaction.on_commit(lambda: run_in_background(OSMImageNote.process_image, note_id))
+        return ret
+
+    @classmethod
+    def process_image(cls, note_id):
+        """
+        Normalise the orientation of the image of the given note and strip its EXIF data, replacing the stored
+        image, and generate its downscaled derivatives. Then mark the image as ready, or as failed if processing it
+        failed for any reason, so that no image stays pending.
+        """
+        note = cls.objects.filter(id=note_id).first()
+        if not (note and note.image):
+            return
+        name = note.image.name
+        storage = note.image.storage
+        image_sizes = []
         try:
-            pilImage = Img.open(BytesIO(self.image.read()))
-        except (UnidentifiedImageError, FileNotFoundError):
-            return super().save(*args, **kwargs)
-
-        for orientation in ExifTags.TAGS:
-            if ExifTags.TAGS[orientation] == "Orientation":
-                break
-
-        exif = pilImage._getexif()
-        if not exif:
-            return super().save(*args, **kwargs)
-
-        exif = dict(exif.items())
-        orientation = exif.get(orientation)
-        if not orientation:
-            return super().save(*args, **kwargs)
-
-        if orientation == 3:
-            pilImage = pilImage.rotate(180, expand=True)
-        elif orientation == 6:
-            pilImage = pilImage.rotate(270, expand=True)
-        elif orientation == 8:
-            pilImage = pilImage.rotate(90, expand=True)
-
-        output = BytesIO()
-        pilImage.save(output, format="JPEG", quality=75)
-        output.seek(0)
-        self.image = File(output, self.image.name)
-
-        return super().save(*args, **kwargs)
+            with storage.open(name) as f:
+                data = f.read()
+            normalized, image = normalized_image(data)
+            if normalized is not None:
+                replace_file(storage, name, ContentFile(normalized))
+            for size, derivative in derivatives(image):
+                replace_file(storage, derivative_name(name, size), ContentFile(derivative))
+                image_sizes.append(size)
+            image_status = "ready"
+        except Exception:
+            # Not only unreadable images but e.g. Image.DecompressionBombError for huge ones:
+            logger.exception(f"Processing the image {name} of image note {note_id} failed")
+            image_status = "failed"
+
+        # Unless another image was uploaded in the meanwhile, to be processed separately:
+        notes = cls.objects.filter(id=note_id, image=name)
+        notes.update(image_status=image_status, image_sizes=image_sizes, modified_at=timezone.now())
+
+    def image_url(self, size=None):
+        """
+        Return the url of the given derivative of the image, if generated, else of the original image.
+        """
+        if size in self.image_sizes:
+            return self.image.storage.url(derivative_name(self.image.name, size))
+        return self.image.url
 
     def is_reviewed(self):
         return bool(self.reviewed_by_id)
@@ -120,6 +179,7 @@ class OSMImageNote(TimestampedModel):
             return
         feature = OSMFeature.objects.get_or_create(id=osm_id)[0]
         self.osm_features.add(feature)
+        touch_image_notes([self.id])
         return feature
 
 
@@ -145,6 +205,17 @@ class OSMImageNoteComment(base.Model):
     def __str__(self):
         return self.comment or super().__str__()
 
+    def save(self, **kwargs):
+        ret = super().save(**kwargs)
+        # Comments are part of the full representation of the note:
+        touch_image_notes([self.image_note_id])
+        return ret
+
+    def delete(self, **kwargs):
+        ret = super().delete(**kwargs)
+        touch_image_notes([self.image_note_id])
+        return ret
+
     def notify_users(self):
         """
         Create OSMImageNoteCommentNotifications for users interested in this image note to notify them of the new
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import re
+import time
+from abc import ABC, abstractmethod
+from time import sleep
+
+import overpy
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from overpy.exception import OverpassTooManyRequests
+
+# Overpass area of Finland, within which nodes are queried:
+default_area_id = 3600034914
+
+re_tag_filter = re.compile(r'^"?(?P<key>[^"=!~]+)"?(?:(?P<op>=|!=|~)"?(?P<value>.*?)"?)?$')
+
+
+def nodes_query(tag_filters, area_id=default_area_id):
+    """
+    Return an Overpass query for the nodes matching any of the given tag filters, fetched in a single request.
+    """
+    node_sets = "".join(f"node[{tag_filter}](area:{area_id});" for tag_filter in tag_filters)
+    return f"[out:json][timeout:90];({node_sets});out;"
+
+
+def tag_filter_matches(tag_filter):
+    """
+    Return a function telling whether a dict of OSM tags matches the given Overpass tag filter, e.g. 'entrance',
+    'amenity=cafe' or 'barrier~"^(gate|lift_gate)$"'.
+    """
+    match = re_tag_filter.match(tag_filter.strip())
+    if not match:
+        raise ValueError(f"Unsupported Overpass tag filter: {tag_filter}")
+    key, op, value = match.group("key", "op", "value")
+    if op == "=":
+        return lambda tags: tags.get(key) == value
+    if op == "!=":
+        return lambda tags: key in tags and tags[key] != value
+    if op == "~":
+        regex = re.compile(value)
+        return lambda tags: key in tags and bool(regex.search(tags[key]))
+    return lambda tags: key in tags
+
+
+def node_as_json(node):
+    return {"type": "node", "id": node.id, "lat": float(node.lat), "lon": float(node.lon), "tags": node.tags}
+
+
+class OSMSource(ABC):
+    """
+    Base class for sources of OSM nodes. Subclasses implement fetch(tag_filters), returning a list including at
+    least all nodes matching any of the filters.
+    """
+
+    @abstractmethod
+    def fetch(self, tag_filters):
+        pass
+
+    def nodes_by_filter(self, tag_filters):
+        """
+        Return {tag filter: matching nodes} for the given Overpass tag filters, fetching the nodes in a single pass.
+        """
+        tag_filters = list(dict.fromkeys(tag_filters))
+        nodes = self.fetch(tag_filters)
+        matchers = {tag_filter: tag_filter_matches(tag_filter) for tag_filter in tag_filters}
+        return {f: [node for node in nodes if matches(node.tags)] for f, matches in matchers.items()}
+
+    def nodes(self, tag_filter):
+        """
+        Return the nodes matching the given Overpass tag filter.
+        """
+        return self.nodes_by_filter([tag_filter])[tag_filter]
+
+
+class OverpassSource(OSMSource):
+    """
+    Fetches OSM nodes in Finland from the Overpass API, caching the responses on disk by a hash of the query, so
+    that reruns within ttl seconds need no network access. Should Overpass refuse a query for too many requests, a
+    stale cached response is used if there is one.
+    """
+
+    def __init__(self, cache_dir=None, ttl=24 * 60 * 60, api=None):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.api = api or overpy.Overpass()
+
+    def cache_path(self, query):
+        return os.path.join(self.cache_dir, hashlib.sha256(query.encode()).hexdigest() + ".json")
+
+    def read_cache(self, query, max_age=None):
+        if not self.cache_dir:
+            return None
+        path = self.cache_path(query)
+        if not os.path.exists(path) or (max_age is not None and time.time() - os.path.getmtime(path) > max_age):
+            return None
+        with open(path) as f:
+            return overpy.Result.from_json(json.load(f)).nodes
+
+    def write_cache(self, query, nodes):
+        if not self.cache_dir:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.cache_path(query)
+        # Write to a temporary file first, so that concurrent readers never see a partial response:
+        with open(f"{path}.tmp", "w") as f:
+            json.dump({"elements": [node_as_json(node) for node in nodes]}, f)
+        os.replace(f"{path}.tmp", path)
+
+    def fetch(self, tag_filters):
+        query = nodes_query(tag_filters)
+        nodes = self.read_cache(query, max_age=self.ttl)
+        if nodes is not None:
+            return nodes
+        try:
+            nodes = self.api.query(query).nodes
+        except OverpassTooManyRequests:
+            nodes = self.read_cache(query)
+            if nodes is not None:
+                return nodes
+            sleep(30)
+            nodes = self.api.query(query).nodes
+        self.write_cache(query, nodes)
+        return nodes
+
+
+class ExtractSource(OSMSource):
+    """
+    Reads OSM nodes from a local extract, either an .osm.pbf file or a .json file in the Overpass JSON format. The
+    tagged nodes of the extract are read once and then filtered for each query.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._nodes = None
+
+    def read_json(self):
+        with open(self.path) as f:
+            return overpy.Result.from_json(json.load(f)).nodes
+
+    def read_pbf(self):
+        try:
+            import osmium
+        except ImportError:
+            raise ImproperlyConfigured("Reading .osm.pbf extracts requires the osmium package.") from None
+
+        elements = []
+
+        class Handler(osmium.SimpleHandler):
+            def node(self, n):
+                if len(n.tags):
+                    location = n.location
+                    tags = {tag.k: tag.v for tag in n.tags}
+                    elements.append(
+                        {"type": "node", "id": n.id, "lat": location.lat, "lon": location.lon, "tags": tags}
+                    )
+
+        Handler().apply_file(self.path)
+        return overpy.Result.from_json({"elements": elements}).nodes
+
+    def all_nodes(self):
+        if self._nodes is None:
+            self._nodes = self.read_pbf() if self.path.endswith(".pbf") else self.read_json()
+        return self._nodes
+
+    def fetch(self, tag_filters):
+        return self.all_nodes()
+
+
+def get_osm_source():
+    """
+    Return the OSM source configured in settings: the extract in OSM_EXTRACT if set, otherwise Overpass cached in
+    OSM_CACHE_DIR.
+    """
+    if settings.OSM_EXTRACT:
+        return ExtractSource(settings.OSM_EXTRACT)
+    return OverpassSource(settings.OSM_CACHE_DIR, settings.OSM_CACHE_TTL)
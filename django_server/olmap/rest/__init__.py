@@ -4,6 +4,7 @@ from rest_framework import routers
 from .views import (
     EntranceViewSet,
     FullOSMImageNotesGeoJSON,
+    ImageNoteTileView,
     NearbyAddressesView,
     OSMFeaturesViewSet,
     OSMImageNoteCommentNotificationsViewSet,
@@ -40,5 +41,6 @@ urlpatterns = [
     path("addresses_at/<str:lon>/<str:lat>/", NearbyAddressesView.as_view(), name="nearby_addresses"),
     path("osm_image_notes.geojson", OSMImageNotesGeoJSON.as_view(), name="osm_image_notes_geojson"),
     path("osm_image_notes_full.geojson", FullOSMImageNotesGeoJSON.as_view(), name="full_osm_image_notes_geojson"),
+    path("tiles/<int:z>/<int:x>/<int:y>.mvt", ImageNoteTileView.as_view(), name="image_note_tile"),
     *router.urls,
 ]
@@ -0,0 +1,52 @@
+import hashlib
+
+from django.db.models import Count, Max, Q
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from olmap import models
+
+
+def image_note_version(queryset):
+    """
+    Return (count, last_modified) for the visible image notes in the given queryset of image notes. The queryset
+    should include hidden notes, so that hiding a note changes the latest modification time. Changes to map
+    features update the modification time of their note, so the version covers those too.
+    """
+    version = queryset.aggregate(last_modified=Max("modified_at"), count=Count("id", filter=Q(visible=True)))
+    return version["count"], version["last_modified"]
+
+
+class ConditionalListMixin:
+    """
+    Answer conditional GET requests for image note listings with 304 Not Modified before querying or serializing
+    the notes, using an ETag derived from image_note_version for the filtered notes. Last-Modified is sent for
+    information only: it has a resolution of a second and does not change when notes are deleted, so 304 responses
+    are only given for a matching If-None-Match.
+    """
+
+    def get_version_queryset(self):
+        return self.filter_queryset(models.OSMImageNote.objects.all())
+
+    def get_list_etag(self, request, count, last_modified):
+        renderer = getattr(request, "accepted_media_type", "")
+        timestamp = last_modified.timestamp() if last_modified else 0
+        version = f"{self.__class__.__name__}:{renderer}:{count}:{timestamp}"
+        return quote_etag(hashlib.md5(version.encode(), usedforsecurity=False).hexdigest())
+
+    def list(self, request, *args, **kwargs):
+        count, last_modified = image_note_version(self.get_version_queryset())
+        etag = self.get_list_etag(request, count, last_modified)
+        last_modified = last_modified and int(last_modified.timestamp())
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = self.list_response(request, *args, **kwargs)
+        response.headers.setdefault("ETag", etag)
+        if last_modified:
+            response.headers.setdefault("Last-Modified", http_date(last_modified))
+        return response
+
+    def list_response(self, request, *args, **kwargs):
+        # Override instead of list to customize the full response:
+        return super().list(request, *args, **kwargs)
@@ -0,0 +1,137 @@
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import filters
+from rest_framework.exceptions import ValidationError
+
+from olmap.utils import tile_bounds
+
+max_zoom = 24
+max_radius = 1000
+
+
+def parse_tile(z, x, y):
+    """
+    Validate slippy map tile coordinates, returning them as ints or raising ValidationError.
+    """
+    try:
+        z, x, y = int(z), int(x), int(y)
+    except (TypeError, ValueError) as e:
+        raise ValidationError({"tile": "z, x and y must be integers."}) from e
+    if not 0 <= z <= max_zoom:
+        raise ValidationError({"z": f"Zoom level must be between 0 and {max_zoom}."})
+    if not (0 <= x < 2**z and 0 <= y < 2**z):
+        raise ValidationError({"tile": f"x and y must be between 0 and {2**z - 1} on zoom level {z}."})
+    return z, x, y
+
+
+def parse_radius(request, default=100):
+    """
+    Return the search radius in meters passed as radius in the query parameters, or default if not passed.
+    """
+    radius = request.query_params.get("radius", None)
+    if radius in (None, ""):
+        return default
+    try:
+        radius = float(radius)
+    except ValueError as e:
+        raise ValidationError({"radius": "Expected a distance in meters."}) from e
+    if not 0 < radius <= max_radius:
+        raise ValidationError({"radius": f"Radius must be between 0 and {max_radius} meters."})
+    return radius
+
+
+class BoundingBoxFilter(filters.BaseFilterBackend):
+    """
+    Limit results to a map viewport, given either as bbox=min_lon,min_lat,max_lon,max_lat or as a slippy map tile
+    using the z, x and y query parameters.
+    """
+
+    lat_field = "lat"
+    lon_field = "lon"
+
+    def get_bounds(self, request):
+        bbox = request.query_params.get("bbox", None)
+        if bbox:
+            try:
+                min_lon, min_lat, max_lon, max_lat = (float(c) for c in bbox.split(","))
+            except ValueError as e:
+                raise ValidationError({"bbox": "Expected bbox=min_lon,min_lat,max_lon,max_lat."}) from e
+            if min_lon > max_lon or min_lat > max_lat:
+                raise ValidationError({"bbox": "Minimum coordinates must not exceed maximum coordinates."})
+            return min_lon, min_lat, max_lon, max_lat
+
+        tile = [request.query_params.get(c, None) for c in ["z", "x", "y"]]
+        if any(tile):
+            return tile_bounds(*parse_tile(*tile))
+
+        return None
+
+    def filter_queryset(self, request, queryset, view):
+        bounds = self.get_bounds(request)
+        if not bounds:
+            return queryset
+        min_lon, min_lat, max_lon, max_lat = bounds
+        return queryset.filter(
+            **{
+                f"{self.lat_field}__gte": min_lat,
+                f"{self.lat_field}__lte": max_lat,
+                f"{self.lon_field}__gte": min_lon,
+                f"{self.lon_field}__lte": max_lon,
+            }
+        )
+
+    def get_schema_operation_parameters(self, view):
+        def param(name, description, schema_type="string"):
+            return {
+                "name": name,
+                "required": False,
+                "in": "query",
+                "description": description,
+                "schema": {"type": schema_type},
+            }
+
+        return [
+            param("bbox", "Only return results within min_lon,min_lat,max_lon,max_lat (WGS84)."),
+            param("z", "Zoom level of a slippy map tile to limit results to, used together with x and y.", "integer"),
+            param("x", "X coordinate of the slippy map tile.", "integer"),
+            param("y", "Y coordinate of the slippy map tile.", "integer"),
+        ]
+
+
+class ChangedSinceFilter(filters.BaseFilterBackend):
+    """
+    Limit results to those modified after the ISO 8601 timestamp given as changed_since, for incremental syncing.
+    """
+
+    modified_field = "modified_at"
+
+    def get_changed_since(self, request):
+        changed_since = request.query_params.get("changed_since", None)
+        if not changed_since:
+            return None
+        try:
+            timestamp = parse_datetime(changed_since)
+        except ValueError:
+            timestamp = None
+        if timestamp is None:
+            raise ValidationError({"changed_since": "Expected an ISO 8601 timestamp, e.g. 2022-03-08T13:04:00Z."})
+        if timezone.is_naive(timestamp):
+            timestamp = timezone.make_aware(timestamp)
+        return timestamp
+
+    def filter_queryset(self, request, queryset, view):
+        changed_since = self.get_changed_since(request)
+        if not changed_since:
+            return queryset
+        return queryset.filter(**{f"{self.modified_field}__gt": changed_since})
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": "changed_since",
+                "required": False,
+                "in": "query",
+                "description": "Only return results modified after this ISO 8601 timestamp.",
+                "schema": {"type": "string", "format": "date-time"},
+            }
+        ]
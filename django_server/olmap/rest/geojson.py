@@ -0,0 +1,50 @@
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def json_encoder():
+    """
+    Return a JSON encoder configured like the DRF JSONRenderer, so that streamed output is identical to that of a
+    rendered Response.
+    """
+    return JSONEncoder(
+        ensure_ascii=not api_settings.UNICODE_JSON,
+        allow_nan=not api_settings.STRICT_JSON,
+        separators=(",", ":") if api_settings.COMPACT_JSON else (", ", ": "),
+    )
+
+
+def encode(encoder, data):
+    # Escape line separators the same way as JSONRenderer does:
+    return encoder.encode(data).replace("\u2028", "\\u2028").replace("\u2029", "\\u2029")
+
+
+def point_feature(lon, lat, properties):
+    return {"type": "Feature", "geometry": {"type": "Point", "coordinates": [lon, lat]}, "properties": properties}
+
+
+def stream_feature_collection(features, buffer_size=64 * 1024):
+    """
+    Yield a GeoJSON FeatureCollection of the given features as chunks of encoded JSON. The features are consumed
+    lazily, so memory use stays flat regardless of the number of features.
+    """
+    encoder = json_encoder()
+    return stream_encoded_feature_collection((encode(encoder, feature) for feature in features), buffer_size)
+
+
+def stream_encoded_feature_collection(encoded_features, buffer_size=64 * 1024):
+    """
+    As stream_feature_collection, but for features already encoded as JSON strings.
+    """
+    encoder = json_encoder()
+    collection_start, collection_end = encode(encoder, {"type": "FeatureCollection", "features": []}).split("[]")
+
+    chunk, chunk_length = [collection_start, "["], 0
+    for i, encoded in enumerate(encoded_features):
+        chunk.append(encoder.item_separator + encoded if i else encoded)
+        chunk_length += len(encoded)
+        if chunk_length >= buffer_size:
+            yield "".join(chunk)
+            chunk, chunk_length = [], 0
+    chunk += ["]", collection_end]
+    yield "".join(chunk)
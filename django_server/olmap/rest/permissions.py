@@ -1,20 +1,97 @@
 from datetime import timedelta
 
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache
+from django.db.models.signals import m2m_changed, post_save, pre_delete
+from django.dispatch import receiver
 from django.utils.timezone import now
 from rest_framework import permissions
 
 REVIEWER_GROUP = "Reviewer"
 
 
+# Cache backends keeping their entries in the memory of each process. Group names are not cached across requests in
+# these, as the other processes would not see the entries being cleared when the groups of a user change:
+PROCESS_LOCAL_CACHE_BACKENDS = [
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+]
+
+
+def group_names_cache_key(user_id):
+    return f"olmap-user-groups-{user_id}"
+
+
+def group_names_cache_enabled():
+    """
+    Return whether group names are cached across requests: only if USER_GROUPS_CACHE_TTL is set and the default cache
+    is shared by all processes serving requests.
+    """
+    return (
+        settings.USER_GROUPS_CACHE_TTL > 0
+        and settings.CACHES[DEFAULT_CACHE_ALIAS]["BACKEND"] not in PROCESS_LOCAL_CACHE_BACKENDS
+    )
+
+
+def user_group_names(user):
+    """
+    Return the names of the groups of the given user as a frozenset. They are loaded once per request, being kept on
+    the user object of the request. If group_names_cache_enabled(), they are also cached for USER_GROUPS_CACHE_TTL
+    seconds or until the groups of the user change, see forget_group_names.
+    """
+    if not user.is_authenticated:
+        return frozenset()
+    names = getattr(user, "_olmap_group_names", None)
+    if names is None:
+        use_cache = group_names_cache_enabled()
+        key = group_names_cache_key(user.id)
+        names = cache.get(key) if use_cache else None
+        if names is None:
+            names = frozenset(user.groups.values_list("name", flat=True))
+            if use_cache:
+                cache.set(key, names, settings.USER_GROUPS_CACHE_TTL)
+        user._olmap_group_names = names
+    return names
+
+
+def user_in_group(user, group_name):
+    return group_name in user_group_names(user)
+
+
 def user_is_reviewer(user):
-    return user.groups.filter(name=REVIEWER_GROUP).exists()
+    return user_in_group(user, REVIEWER_GROUP)
+
+
+def forget_group_names(user_ids):
+    if group_names_cache_enabled():
+        cache.delete_many([group_names_cache_key(user_id) for user_id in user_ids])
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            forget_group_names([instance.id])
+    elif action in ("post_add", "post_remove"):
+        forget_group_names(pk_set)
+    elif action == "pre_clear":
+        # Cleared through group.user_set.clear(), which passes no user ids:
+        forget_group_names(instance.user_set.values_list("id", flat=True))
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    # Renaming or deleting a group changes the group names of its users:
+    forget_group_names(instance.user_set.values_list("id", flat=True))
 
 
 class UserBelongsToGroup(permissions.IsAuthenticated):
     group_name = "OVERRIDE IN SUBCLASSES!"
 
     def has_permission(self, request, view):
-        return super().has_permission(request, view) and request.user.groups.filter(name=self.group_name).exists()
+        return super().has_permission(request, view) and user_in_group(request.user, self.group_name)
 
 
 class IsReviewer(UserBelongsToGroup):
@@ -28,7 +105,7 @@ class IsReviewerOrCreator(permissions.BasePermission):
             # Anonymous users can edit new anonymous notes in order to be able to attach an image to a freshly
             # created note:
             return image_note_obj.created_by is None and image_note_obj.created_at > now() - timedelta(minutes=30)
-        if request.user.groups.filter(name=REVIEWER_GROUP).exists():
+        if user_is_reviewer(request.user):
             return True
         return image_note_obj.created_by_id == request.user.id
 
@@ -128,9 +128,11 @@ class SchemaWithParameters(AutoSchema):
         return sup
 
 
-def with_parameters(params):
+def with_parameters(params, optional=()):
     def decorator(f):
-        f.parameters = [{"name": a, "in": "query", "required": True, "schema": {"type": "string"}} for a in params]
+        f.parameters = [
+            {"name": a, "in": "query", "required": a not in optional, "schema": {"type": "string"}} for a in params
+        ]
         return f
 
     return decorator
@@ -3,15 +3,20 @@ from collections import OrderedDict
 from rest_framework import serializers
 
 from olmap import models
+from olmap.images import derivative_urls
 
 
 class BaseOSMImageNoteSerializer(serializers.ModelSerializer):
+    image_derivatives = serializers.SerializerMethodField()
+
     class Meta:
         model = models.OSMImageNote
         fields = [
             "id",
             "comment",
             "image",
+            "image_status",
+            "image_derivatives",
             "lat",
             "lon",
             "is_reviewed",
@@ -24,6 +29,9 @@ class BaseOSMImageNoteSerializer(serializers.ModelSerializer):
             "layer",
         ]
 
+    def get_image_derivatives(self, note):
+        return derivative_urls(note.image.name if note.image else None, note.image_sizes)
+
     def to_representation(self, instance):
         result = super().to_representation(instance)
         return OrderedDict([(key, result[key]) for key in result if result[key] not in [None, []]])
@@ -0,0 +1,98 @@
+from django.db.models.fields.related_descriptors import (
+    ForwardManyToOneDescriptor,
+    ManyToManyDescriptor,
+    ReverseManyToOneDescriptor,
+    ReverseOneToOneDescriptor,
+)
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, RelatedField
+
+
+def relation(model, name):
+    """
+    Return (related_model, many) for the relation called name on model, or None if name is not a relation.
+    """
+    descriptor = getattr(model, name, None)
+    if isinstance(descriptor, ForwardManyToOneDescriptor):
+        return descriptor.field.related_model, False
+    if isinstance(descriptor, ReverseOneToOneDescriptor):
+        return descriptor.related.related_model, False
+    if isinstance(descriptor, ManyToManyDescriptor):
+        field = descriptor.field
+        return (field.model if descriptor.reverse else field.related_model), True
+    if isinstance(descriptor, ReverseManyToOneDescriptor):
+        return descriptor.rel.related_model, True
+    return None
+
+
+def relation_path(model, lookup):
+    """
+    Return (related_model, many) for a lookup of relations separated by __, or None if it is not one.
+    """
+    many = False
+    for name in lookup.split("__"):
+        related = relation(model, name)
+        if related is None:
+            return None
+        model, many_here = related
+        many = many or many_here
+    return model, many
+
+
+def eager_loading_lookups(serializer, model, prefix="", single=True):
+    """
+    Yield (lookup, single) for each relation accessed when serializing instances of model using serializer, where
+    single tells whether the lookup follows only single valued relations and so can be used with select_related.
+    """
+    related_sources = getattr(serializer, "related_sources", {})
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        if field.source == "*":
+            if isinstance(field, serializers.BaseSerializer):
+                yield from eager_loading_lookups(field, model, prefix, single)
+            continue
+
+        source = related_sources.get(field.field_name, field.source.replace(".", "__"))
+        related = relation_path(model, source)
+        if related is None:
+            continue
+        related_model, many = related
+
+        if isinstance(field, serializers.ListSerializer):
+            field = field.child
+        elif isinstance(field, ManyRelatedField):
+            field = field.child_relation
+        if isinstance(field, RelatedField) and field.use_pk_only_optimization() and not many:
+            # Serializing only the id of a foreign key needs no query:
+            continue
+
+        lookup = f"{prefix}{source}"
+        yield lookup, single and not many
+        if isinstance(field, serializers.BaseSerializer):
+            yield from eager_loading_lookups(field, related_model, f"{lookup}__", single and not many)
+
+
+class EagerLoadingMixin:
+    """
+    Serializer mixin for fetching all relations used by the serializer, including nested serializers, up front using
+    select_related and prefetch_related, so that serializing any number of instances takes a fixed number of queries.
+
+    The lookups are derived from the serializer fields. Fields with a model method or property as source can be
+    mapped to the relations the method uses through related_sources, e.g. {"image_note": "entrance__image_note"}.
+    """
+
+    @classmethod
+    def get_eager_loading_lookups(cls):
+        if "_eager_loading_lookups" not in cls.__dict__:
+            lookups = list(dict.fromkeys(eager_loading_lookups(cls(), cls.Meta.model)))
+            cls._eager_loading_lookups = (
+                [lookup for lookup, single in lookups if single],
+                [lookup for lookup, single in lookups if not single],
+            )
+        return cls._eager_loading_lookups
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        select_related, prefetch_related = cls.get_eager_loading_lookups()
+        return queryset.select_related(*select_related).prefetch_related(*prefetch_related)
@@ -1,13 +1,15 @@
-from django.conf import settings
-from google.cloud import translate_v2 as translate
 from rest_framework import serializers
 
+from olmap.translation import get_translation_cache
+
 
 class TranslationSerializerMixin:
     translated_fields = []  # Override in subclasses
 
     def get_requested_language(self):
-        return self.context["request"].query_params.get("language", None)
+        request = self.context.get("request", None)
+        # No translations when serializing outside of a request, e.g. for pre-rendered snapshots:
+        return request.query_params.get("language", None) if request else None
 
     def create_translated_fields(self, instance):
         if len(self.translated_fields) == 0:
@@ -31,13 +33,20 @@ class TranslationSerializerMixin:
         if not len(instance_fields):
             return
 
-        translate_client = translate.Client.from_service_account_json(settings.GOOGLE_ACCOUNT_JSON)
+        # Texts are translated in the background when saved, so only look up their translations here:
         values = [getattr(instance, f) for instance, f in instance_fields]
-        result = translate_client.translate(values, target_language=language)
-
-        for i, (instance, f) in enumerate(instance_fields):
-            setattr(instance, f + "_translated", result[i]["translatedText"])
-            setattr(instance, f + "_language", result[i]["detectedSourceLanguage"])
+        result = get_translation_cache().lookup(values, language)
+
+        for (instance, f), translation in zip(instance_fields, result, strict=True):
+            translated_text, source_language = translation or (None, None)
+            setattr(instance, f + "_translated", translated_text)
+            setattr(instance, f + "_language", source_language)
+
+        # Texts saved before their translations were stored, or requested in languages other than
+        # settings.TRANSLATION_LANGUAGES, are translated for the next request:
+        untranslated = [value for value, translation in zip(values, result, strict=True) if not translation]
+        if untranslated:
+            get_translation_cache().translate_in_background(untranslated, language)
 
 
 class TranslatedField(serializers.Field):
@@ -40,9 +40,15 @@ class MapFeatureSerializer(serializers.ModelSerializer):
         required=False, allow_null=True, queryset=models.OSMFeature.objects
     )
 
+    # Link queue bookkeeping of the automatic linkers, left out of the API:
+    hidden_fields = ["modified_at", "link_checked_at"]
+
     # Register custom subclasses for specific map feature types here:
     registered_subclasses = {}
 
+    def get_field_names(self, declared_fields, info):
+        return [name for name in super().get_field_names(declared_fields, info) if name not in self.hidden_fields]
+
     @classmethod
     def get_subclass_for(cls, prop_type):
         subcls = cls.registered_subclasses.get(prop_type, None)
@@ -71,7 +77,7 @@ class UnloadingPlaceWithNoteSerializer(TranslationSerializerMixin, MapFeatureSer
     description_translated = TranslatedField()
     description_language = TranslatedField()
 
-    translated_fields = ["description"]  # Used by TranslationSerializerMixin
+    translated_fields = models.UnloadingPlace.translated_fields  # Used by TranslationSerializerMixin
 
     class Meta:
         model = models.UnloadingPlace
@@ -91,7 +97,9 @@ class WorkplaceEntranceSerializer(TranslationSerializerMixin, serializers.ModelS
     description_translated = TranslatedField()
     description_language = TranslatedField()
 
-    translated_fields = ["delivery_instructions", "description"]  # Used by TranslationSerializerMixin
+    translated_fields = models.WorkplaceEntrance.translated_fields  # Used by TranslationSerializerMixin
+    # Relations used by the image_note and unloading_places methods, for EagerLoadingMixin:
+    related_sources = {"image_note": "entrance__image_note", "unloading_places": "entrance__unloading_places"}
 
     class Meta:
         model = models.WorkplaceEntrance
@@ -127,7 +135,7 @@ class WorkplaceSerializer(TranslationSerializerMixin, MapFeatureSerializer):
     delivery_instructions_translated = TranslatedField()
     delivery_instructions_language = TranslatedField()
 
-    translated_fields = ["delivery_instructions"]  # Used by TranslationSerializerMixin
+    translated_fields = models.Workplace.translated_fields  # Used by TranslationSerializerMixin
 
     class Meta:
         model = models.Workplace
@@ -1,10 +1,15 @@
 from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import Count, Q
 from rest_framework import serializers
 
 from olmap import models
-from olmap.models.map_features import manager_name
+from olmap.images import derivative_urls
+from olmap.models.map_features import manager_name, save_image_note_map_features
 
 from .base import BaseOSMImageNoteSerializer
+from .eager_loading import EagerLoadingMixin
 from .map_features import MapFeatureSerializer
 from .user import BaseUserSerializer
 
@@ -25,20 +30,12 @@ class OSMImageNoteCommentNotificationSerializer(serializers.ModelSerializer):
         fields = ["comment", "id"]
 
 
-def height_index():
+def with_delivery_instructions(queryset):
     """
-    Return a dict {image_note_id: height} for height limitations on workplaces, entrances, gates and building passages.
+    Annotate image notes with the number of workplaces with delivery instructions attached to each note.
     """
-    index = {}
-    for Model in [models.Entrance, models.Gate, models.BuildingPassage]:
-        for i in Model.objects.filter(height__isnull=False).values("image_note_id", "height"):
-            index[i["image_note_id"]] = i["height"]
-
-    workplaces = models.Workplace.objects.filter(max_vehicle_height__isnull=False)
-    for i in workplaces.values("image_note_id", "max_vehicle_height"):
-        index[i["image_note_id"]] = i["max_vehicle_height"]
-
-    return index
+    instructions_count = Count("workplace", filter=~Q(workplace__delivery_instructions=""))
+    return queryset.annotate(delivery_instructions=instructions_count)
 
 
 class DictOSMImageNoteSerializer(BaseOSMImageNoteSerializer):
@@ -46,7 +43,7 @@ class DictOSMImageNoteSerializer(BaseOSMImageNoteSerializer):
     is_processed = serializers.BooleanField(read_only=True, source="processed_by_id")
     is_accepted = serializers.BooleanField(read_only=True, source="accepted_by_id")
     delivery_instructions = serializers.SerializerMethodField()
-    height = serializers.SerializerMethodField()
+    height = serializers.ReadOnlyField(source="height_limit")
     created_by = serializers.IntegerField(read_only=True, source="created_by_id")
     image = serializers.SerializerMethodField()
 
@@ -57,6 +54,10 @@ class DictOSMImageNoteSerializer(BaseOSMImageNoteSerializer):
         fields = [*BaseOSMImageNoteSerializer.Meta.fields, "delivery_instructions", "height"]
 
     def to_representation(self, instance):
+        if not instance.get("visible", True):
+            # Hidden notes are only listed when syncing changes, as tombstones telling clients to remove them:
+            modified_at = self.fields["modified_at"].to_representation(instance["modified_at"])
+            return {"id": instance["id"], "visible": False, "modified_at": modified_at}
         result = super().to_representation(instance)
         for field in self.false_default_fields:
             result.setdefault(field, False)
@@ -65,14 +66,12 @@ class DictOSMImageNoteSerializer(BaseOSMImageNoteSerializer):
     def get_image(self, note):
         return settings.MEDIA_URL + note["image"] if note.get("image", None) else None
 
+    def get_image_derivatives(self, note):
+        return derivative_urls(note.get("image"), note.get("image_sizes"))
+
     def get_delivery_instructions(self, note):
         return note.get("delivery_instructions", 0) > 0
 
-    def get_height(self, note):
-        if not hasattr(self, "_height_index"):
-            self._height_index = height_index()
-        return self._height_index.get(note["id"], None)
-
 
 class OSMImageNoteSerializer(BaseOSMImageNoteSerializer):
     # upvotes = serializers.SlugRelatedField(many=True, read_only=True, slug_field='user_id')
@@ -93,10 +92,12 @@ class OSMImageNoteSerializerMeta(serializers.SerializerMetaclass):
         return super().__new__(mcs, name, bases, attrs)
 
 
-class OSMImageNoteWithMapFeaturesSerializer(OSMImageNoteSerializer, metaclass=OSMImageNoteSerializerMeta):
+class OSMImageNoteWithMapFeaturesSerializer(
+    EagerLoadingMixin, OSMImageNoteSerializer, metaclass=OSMImageNoteSerializerMeta
+):
     created_by = BaseUserSerializer(read_only=True)
     delivery_instructions = serializers.SerializerMethodField()
-    height = serializers.SerializerMethodField()
+    height = serializers.ReadOnlyField(source="height_limit")
 
     class Meta:
         model = models.OSMImageNote
@@ -109,29 +110,21 @@ class OSMImageNoteWithMapFeaturesSerializer(OSMImageNoteSerializer, metaclass=OS
     def get_delivery_instructions(self, note):
         return getattr(note, "delivery_instructions", 0) > 0
 
-    def get_height(self, note):
-        if not hasattr(self, "_height_index"):
-            self._height_index = height_index()
-        return self._height_index.get(note.id, None)
-
     def create(self, validated_data):
         relateds = self.extract_related_map_features(validated_data)
-        instance = super().create(validated_data)
-        self.save_related_map_features(instance, relateds, new=True)
+        with transaction.atomic():
+            instance = super().create(validated_data)
+            self.save_related_map_features(instance, relateds)
         return instance
 
-    def save_related_map_features(self, instance, relateds, new=False):
-        for related_field, fields_list in relateds.items():
-            related_manager = getattr(instance, related_field)
-            related_manager.exclude(id__in=[f["id"] for f in fields_list if f.get("id", None)]).delete()
-            for fields in fields_list:
-                if fields.get("id", None):
-                    f = related_manager.get(id=fields["id"])
-                    for k, v in fields.items():
-                        setattr(f, k, v)
-                    f.save()
-                else:
-                    related_manager.create(**fields)
+    def save_related_map_features(self, instance, relateds):
+        fields_by_type = {t: relateds[manager_name(t)] for t in models.map_feature_types if manager_name(t) in relateds}
+        try:
+            saved = save_image_note_map_features(instance, fields_by_type)
+        except ObjectDoesNotExist as e:
+            raise serializers.ValidationError(str(e)) from e
+        # Kept to represent the saved map features without reloading them, see to_representation:
+        instance.saved_map_features = {manager_name(prop_type): features for prop_type, features in saved.items()}
 
     def extract_related_map_features(self, validated_data):
         relateds = {}
@@ -143,5 +136,15 @@ class OSMImageNoteWithMapFeaturesSerializer(OSMImageNoteSerializer, metaclass=OS
 
     def update(self, instance, validated_data):
         relateds = self.extract_related_map_features(validated_data)
-        self.save_related_map_features(instance, relateds)
-        return super().update(instance, validated_data)
+        with transaction.atomic():
+            self.save_related_map_features(instance, relateds)
+            return super().update(instance, validated_data)
+
+    def to_representation(self, instance):
+        saved_map_features = getattr(instance, "saved_map_features", None)
+        if saved_map_features:
+            # DRF drops prefetched relations after updates, so restore the saved map features in their place:
+            if not hasattr(instance, "_prefetched_objects_cache"):
+                instance._prefetched_objects_cache = {}
+            instance._prefetched_objects_cache.update(saved_map_features)
+        return super().to_representation(instance)
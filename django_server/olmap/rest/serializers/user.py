@@ -1,7 +1,7 @@
 from django.contrib.auth.models import User
 from rest_framework import serializers
 
-from olmap.rest.permissions import REVIEWER_GROUP
+from olmap.rest.permissions import user_is_reviewer
 
 
 class BaseUserSerializer(serializers.ModelSerializer):
@@ -17,8 +17,5 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
         fields = ["id", "first_name", "last_name", "username", "is_reviewer"]
 
-    def user_in_group(self, user, group_name):
-        return any(group.name == group_name for group in user.groups.all())
-
     def get_is_reviewer(self, user):
-        return self.user_in_group(user, REVIEWER_GROUP)
+        return user_is_reviewer(user)
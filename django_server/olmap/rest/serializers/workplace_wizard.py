@@ -1,9 +1,12 @@
 import contextlib
 
+from django.db import transaction
 from rest_framework import serializers
 
 from olmap import models
+from olmap.models.map_features import WithLayer, height_limit_types, update_height_limits
 from olmap.rest.schema import with_example
+from olmap.translation import pretranslate_on_commit
 
 
 class MapFeatureSerializer(serializers.ModelSerializer):
@@ -42,9 +45,8 @@ class MapFeatureSerializer(serializers.ModelSerializer):
 
         if not note_id:
             user_id = self.context["request"].user.id
-            note = models.OSMImageNote.objects.create(
-                tags=[self.Meta.model.__name__], created_by_id=user_id, **note_fields
-            )
+            note = self.Meta.model.new_image_note(created_by_id=user_id, **note_fields)
+            note.save()
             validated_data["image_note_id"] = note.id
 
         instance = super().create(validated_data)
@@ -67,6 +69,18 @@ class MapFeatureSerializer(serializers.ModelSerializer):
 mf_fields = MapFeatureSerializer.Meta.fields
 
 
+def in_bulk_or_invalid(queryset, ids):
+    """
+    Return {id: instance} for the given ids in queryset. Raise ValidationError if any of them is not found there, e.g.
+    ids of map features not belonging to the workplace or entrance being saved.
+    """
+    existing = queryset.in_bulk(ids)
+    missing = set(ids) - existing.keys()
+    if missing:
+        raise serializers.ValidationError(f"Invalid {queryset.model._meta.verbose_name} ids: {sorted(missing)}")
+    return existing
+
+
 class UnloadingPlaceSerializer(MapFeatureSerializer):
     class Meta:
         model = models.UnloadingPlace
@@ -122,23 +136,17 @@ class EntranceSerializer(MapFeatureSerializer):
             for up in extra_ups:
                 entrance.unloading_places.remove(up)
         serializer = UnloadingPlaceSerializer(context=self.context)
+        ids = [f["id"] for f in unloading_places_data if f.get("id", None)]
+        existing = in_bulk_or_invalid(models.UnloadingPlace.objects.select_related("image_note"), ids)
         for up_data in unloading_places_data:
             id = up_data.get("id", None)
             if id:
-                up = models.UnloadingPlace.objects.select_related("image_note").get(id=id)
+                up = existing[id]
                 serializer.update(up, up_data)
             else:
                 up = serializer.create(up_data)
             entrance.unloading_places.add(up)
 
-    def create(self, validated_data):
-        unloading_places = validated_data.pop("unloading_places", [])
-
-        entrance = super().create(validated_data)
-
-        self.update_unloading_places(entrance, unloading_places)
-        return entrance
-
 
 class WorkplaceEntranceSerializer(serializers.ModelSerializer):
     lat = serializers.FloatField(source="entrance.image_note.lat")
@@ -179,27 +187,6 @@ class WorkplaceEntranceSerializer(serializers.ModelSerializer):
         serializer = EntranceSerializer(context=self.context)
         serializer.update(instance.entrance, entrance_data)
 
-    def create(self, validated_data):
-        entrance_fields = self.extract_entrance(validated_data)
-        entrance_or_id = validated_data.pop("entrance_id", None)
-        field = "entrance_id" if isinstance(entrance_or_id, int) else "entrance"
-        validated_data[field] = entrance_or_id
-
-        if not entrance_or_id:
-            serializer = EntranceSerializer(context=self.context)
-            osm_id = entrance_fields.get("osm_feature_id", None)
-            if osm_id:
-                models.OSMFeature.objects.get_or_create(id=osm_id)
-            entrance = serializer.create(entrance_fields)
-            validated_data["entrance_id"] = entrance.id
-
-        wp_entrance = super().create(validated_data)
-
-        if entrance_or_id:
-            self.update_entrance(wp_entrance, entrance_fields)
-
-        return wp_entrance
-
 
 example_workplace = {
     "street": "Unioninkatu",
@@ -252,27 +239,190 @@ class WorkplaceSerializer(MapFeatureSerializer):
 
     def update(self, instance, validated_data):
         entrances = validated_data.pop("workplace_entrances", [])
-        workplace = super().update(instance, validated_data)
-        self.update_entrances(workplace, entrances)
+        with transaction.atomic():
+            workplace = super().update(instance, validated_data)
+            self.update_entrances(workplace, entrances)
         return workplace
 
     def update_entrances(self, workplace, entrances_data):
-        workplace.workplace_entrances.exclude(id__in=[f["id"] for f in entrances_data if f.get("id", None)]).delete()
+        ids = [f["id"] for f in entrances_data if f.get("id", None)]
+        workplace.workplace_entrances.exclude(id__in=ids).delete()
+        existing = in_bulk_or_invalid(workplace.workplace_entrances.select_related("entrance__image_note"), ids)
         serializer = WorkplaceEntranceSerializer(context=self.context)
+        plan = WorkplaceTreePlan(self.context)
         for entrance_data in entrances_data:
             id = entrance_data.get("id", None)
             if id:
-                entrance = workplace.workplace_entrances.select_related("entrance__image_note").get(id=id)
-                serializer.update(entrance, entrance_data)
+                serializer.update(existing[id], entrance_data)
             else:
-                serializer.create(dict(entrance_data, workplace=workplace))
+                plan.add_workplace_entrance(workplace, entrance_data)
+        plan.write()
 
     def create(self, validated_data):
         entrances = validated_data.pop("workplace_entrances", [])
-        wpt = models.WorkplaceType.objects.get_or_create(label="Company")[0]
-        validated_data["type"] = wpt
+        with transaction.atomic():
+            validated_data["type"] = models.WorkplaceType.objects.get_or_create(label="Company")[0]
+            plan = WorkplaceTreePlan(self.context)
+            workplace = plan.add_feature(models.Workplace, validated_data)
+            workplace_entrances = [plan.add_workplace_entrance(workplace, e) for e in entrances]
+            plan.write()
+        # The whole tree is known, so it is represented without reloading it:
+        workplace._prefetched_objects_cache = {"workplace_entrances": workplace_entrances}
+        return workplace
 
-        workplace = super().create(validated_data)
 
-        self.update_entrances(workplace, entrances)
-        return workplace
+class WorkplaceTreePlan:
+    """
+    Plans the writes for the new image notes, map features and links of a tree of workplace, entrances and unloading
+    places submitted to the workplace wizard, given as validated data of the serializers above. write() then creates
+    them with a single bulk write per table, the changes their save methods would make to related objects being
+    made in memory first, using the same model methods. Existing objects referred to in the tree are updated by the
+    serializers after the bulk writes.
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self.user_id = context["request"].user.id
+        self.new_notes = []
+        self.existing_notes = []
+        # Names of the image note fields given in the tree:
+        self.note_fields = set()
+        self.osm_ids = set()
+        self.features = {models.Workplace: [], models.Entrance: [], models.UnloadingPlace: []}
+        self.workplace_entrances = []
+        # (unloading place, entrance) pairs to link:
+        self.unloading_place_entrances = []
+        # (entrance, validated data) of existing objects to update after the bulk writes:
+        self.existing_entrances = []
+        self.existing_unloading_places = []
+
+    def add_feature(self, model, fields):
+        """
+        Plan the creation of a map feature of the given model from the validated fields of MapFeatureSerializer,
+        along with its image note unless an existing one is given. Return the unsaved instance.
+        """
+        fields = dict(fields)
+        fields.pop("id", None)
+        note_fields = fields.pop("image_note", {})
+        note = fields.pop("image_note_id", None)
+        if note:
+            if isinstance(note, int):
+                note = models.OSMImageNote.objects.get(id=note)
+            self.existing_notes.append(note)
+        else:
+            note = model.new_image_note(created_by_id=self.user_id)
+            self.new_notes.append(note)
+        for f, v in note_fields.items():
+            setattr(note, f, v)
+        self.note_fields.update(note_fields)
+        if fields.get("osm_feature_id", None):
+            self.osm_ids.add(fields["osm_feature_id"])
+        instance = model(image_note=note, **fields)
+        if isinstance(instance, WithLayer):
+            instance.copy_layer_to_note()
+        self.features[model].append(instance)
+        return instance
+
+    def add_entrance(self, fields):
+        fields = dict(fields)
+        unloading_places = fields.pop("unloading_places", [])
+        entrance = self.add_feature(models.Entrance, fields)
+        entrance._prefetched_objects_cache = {"unloading_places": []}
+        for up_data in unloading_places:
+            if up_data.get("id", None):
+                self.existing_unloading_places.append((entrance, up_data))
+            else:
+                self.add_unloading_place(entrance, up_data)
+        return entrance
+
+    def add_unloading_place(self, entrance, fields):
+        fields = dict(fields)
+        entrances = [entrance, *fields.pop("entrances", [])]
+        unloading_place = self.add_feature(models.UnloadingPlace, fields)
+        unloading_place._prefetched_objects_cache = {"entrances": entrances}
+        entrance._prefetched_objects_cache["unloading_places"].append(unloading_place)
+        self.unloading_place_entrances += [(unloading_place, e) for e in entrances]
+        return unloading_place
+
+    def add_workplace_entrance(self, workplace, fields):
+        """
+        Plan the creation of a workplace entrance from the validated fields of WorkplaceEntranceSerializer, along
+        with its entrance unless an existing one is given. Return the unsaved instance.
+        """
+        fields = dict(fields)
+        fields.pop("id", None)
+        entrance_fields = fields.pop("entrance", {})
+        entrance = fields.pop("entrance_id", None)
+        if entrance:
+            self.existing_entrances.append((entrance, entrance_fields))
+        else:
+            entrance = self.add_entrance(entrance_fields)
+        workplace_entrance = models.WorkplaceEntrance(workplace=workplace, entrance=entrance, **fields)
+        workplace_entrance.describe_entrance()
+        self.workplace_entrances.append(workplace_entrance)
+        return workplace_entrance
+
+    def write(self):
+        if self.osm_ids:
+            models.OSMFeature.objects.bulk_create(
+                [models.OSMFeature(id=id) for id in self.osm_ids], ignore_conflicts=True
+            )
+        for note in self.existing_notes:
+            note.save()
+        # Notes with an uploaded image are saved one by one, so that their images get processed:
+        uploads = [note for note in self.new_notes if note.image and not note.image._committed]
+        for note in uploads:
+            note.save()
+        models.OSMImageNote.objects.bulk_create([note for note in self.new_notes if note.pk is None])
+        self.read_back_notes()
+        for model, instances in self.features.items():
+            if instances:
+                model.objects.bulk_create(instances)
+
+        existing = in_bulk_or_invalid(
+            models.UnloadingPlace.objects.select_related("image_note"),
+            [up_data["id"] for _, up_data in self.existing_unloading_places],
+        )
+        serializer = UnloadingPlaceSerializer(context=self.context)
+        for entrance, up_data in self.existing_unloading_places:
+            unloading_place = serializer.update(existing[up_data["id"]], up_data)
+            entrance._prefetched_objects_cache["unloading_places"].append(unloading_place)
+            self.unloading_place_entrances.append((unloading_place, entrance))
+        Link = models.UnloadingPlace.entrances.through
+        links = {(up.id, e.id) for up, e in self.unloading_place_entrances}
+        Link.objects.bulk_create(
+            [Link(unloadingplace_id=up_id, entrance_id=e_id) for up_id, e_id in links], ignore_conflicts=True
+        )
+
+        models.WorkplaceEntrance.objects.bulk_create(self.workplace_entrances)
+        pretranslate_on_commit(
+            [*self.features[models.Workplace], *self.workplace_entrances, *self.features[models.UnloadingPlace]]
+        )
+        serializer = EntranceSerializer(context=self.context)
+        for entrance, entrance_fields in self.existing_entrances:
+            serializer.update(entrance, entrance_fields)
+
+        height_note_ids = [
+            instance.image_note_id
+            for model in height_limit_types
+            for instance in self.features.get(model, [])
+            if getattr(instance, model.height_limit_field) is not None
+        ]
+        if height_note_ids:
+            update_height_limits(height_note_ids)
+
+    def read_back_notes(self):
+        """
+        Set the given fields of the saved image notes to their values as stored, e.g. coordinates rounded to their
+        decimal places, so that the tree can be represented without reloading it.
+        """
+        notes = [*self.existing_notes, *self.new_notes]
+        # Uploaded images are already stored:
+        fields = sorted(self.note_fields - {"image"})
+        if not (notes and fields):
+            return
+        stored = models.OSMImageNote.objects.filter(id__in=[note.id for note in notes]).values("id", *fields)
+        stored = {values["id"]: values for values in stored}
+        for note in notes:
+            for f in fields:
+                setattr(note, f, stored[note.id][f])
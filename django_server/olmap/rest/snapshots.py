@@ -0,0 +1,198 @@
+import gzip
+import heapq
+import os
+import tempfile
+from collections import namedtuple
+from datetime import UTC, datetime, timedelta
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import connection
+from django.utils import timezone
+
+from olmap import models
+from olmap.background import run_in_background
+from olmap.rest.conditional import image_note_version
+from olmap.rest.geojson import encode, json_encoder, point_feature, stream_encoded_feature_collection
+from olmap.rest.serializers import OSMImageNoteWithMapFeaturesSerializer
+from olmap.rest.serializers.osm_image_note import with_delivery_instructions
+
+Snapshot = namedtuple("Snapshot", ["name", "index_name", "built_at", "last_modified", "count"])
+
+
+def timestamp_to_datetime(microseconds):
+    return datetime.fromtimestamp(int(microseconds) / 1e6, UTC)
+
+
+def datetime_to_timestamp(dt):
+    return int(dt.timestamp() * 1e6) if dt else 0
+
+
+class FullGeoJSONSnapshot:
+    """
+    Pre-rendered gzipped GeoJSON of all visible image notes with their map features, as served by
+    FullOSMImageNotesGeoJSON. Alongside each snapshot an index of the encoded feature of each note is stored, so that
+    rebuilding the snapshot only needs to serialize the notes modified since the previous one. Both files are first
+    written under a temporary name and then renamed into place, snapshot last, so that a snapshot is only ever listed
+    once it and its index are complete.
+
+    Snapshots are named {built_at}-{last_modified}-{count}, using the image note version they were built from. As
+    they include notes visible only to reviewers, they are stored under settings.SNAPSHOT_ROOT rather than in the
+    publicly served media storage.
+    """
+
+    directory = "osm_image_notes_full"
+    suffix = ".geojson.gz"
+    index_suffix = ".index.gz"
+    # Appended to the names of files still being written:
+    temporary_suffix = ".tmp"
+    # Number of notes fetched from the db at a time:
+    chunk_size = 500
+    # Also re-render notes modified a bit before the previous snapshot, in case their changes were committed late:
+    safety_margin = timedelta(minutes=1)
+    # Key of the database advisory lock held while building, shared by all processes:
+    lock_id = 0x01A7_5A95
+
+    def __init__(self, storage=None):
+        self.storage = storage or FileSystemStorage(location=settings.SNAPSHOT_ROOT)
+
+    def snapshots(self):
+        if not self.storage.exists(self.directory):
+            return []
+        snapshots = []
+        for filename in self.storage.listdir(self.directory)[1]:
+            if filename.endswith(self.suffix):
+                stem = filename[: -len(self.suffix)]
+                built_at, last_modified, count = stem.split("-")
+                snapshots.append(
+                    Snapshot(
+                        f"{self.directory}/{filename}",
+                        f"{self.directory}/{stem}{self.index_suffix}",
+                        timestamp_to_datetime(built_at),
+                        timestamp_to_datetime(last_modified),
+                        int(count),
+                    )
+                )
+        return sorted(snapshots, key=lambda s: s.built_at)
+
+    def latest(self):
+        snapshots = self.snapshots()
+        return snapshots[-1] if snapshots else None
+
+    def current_version(self):
+        count, last_modified = image_note_version(models.OSMImageNote.objects.all())
+        return count, datetime_to_timestamp(last_modified)
+
+    def is_current(self, snapshot):
+        return self.current_version() == (snapshot.count, datetime_to_timestamp(snapshot.last_modified))
+
+    def get_queryset(self):
+        notes = with_delivery_instructions(models.OSMImageNote.objects.filter(visible=True)).order_by("id")
+        return OSMImageNoteWithMapFeaturesSerializer.setup_eager_loading(notes)
+
+    def render(self, notes):
+        """
+        Yield (id, encoded feature) for the given notes.
+        """
+        serializer = OSMImageNoteWithMapFeaturesSerializer()
+        encoder = json_encoder()
+        for note in notes.iterator(chunk_size=self.chunk_size):
+            properties = serializer.to_representation(note)
+            if properties.get("image", None):
+                # Rendered without a request, so make the image url absolute as in other responses:
+                properties["image"] = urljoin(settings.SITE_URL, properties["image"])
+            feature = point_feature(note.lon, note.lat, properties)
+            yield note.id, encode(encoder, feature)
+
+    def read_index(self, snapshot):
+        """
+        Yield (id, encoded feature) for the notes in the given snapshot.
+        """
+        with self.storage.open(snapshot.index_name) as f, gzip.GzipFile(fileobj=f) as index:
+            for line in index:
+                note_id, feature = line.decode().rstrip("\n").split("\t", 1)
+                yield int(note_id), feature
+
+    def build(self, full=False):
+        """
+        Build a new snapshot, reusing the features of the latest snapshot for notes not modified since then unless
+        full is set. Return the new snapshot.
+        """
+        # Read the version first, so that any changes made during the build trigger another build:
+        count, last_modified = self.current_version()
+        notes = self.get_queryset()
+        previous = None if full else self.latest()
+        if previous:
+            changed = notes.filter(modified_at__gte=previous.last_modified - self.safety_margin)
+            changed_ids = set(changed.values_list("id", flat=True))
+            visible_ids = set(notes.values_list("id", flat=True))
+            kept = (f for f in self.read_index(previous) if f[0] in visible_ids and f[0] not in changed_ids)
+            features = heapq.merge(kept, self.render(changed))
+        else:
+            features = self.render(notes)
+
+        stem = f"{datetime_to_timestamp(timezone.now())}-{last_modified}-{count}"
+        with tempfile.TemporaryFile() as snapshot_file, tempfile.TemporaryFile() as index_file:
+            with (
+                gzip.GzipFile(fileobj=snapshot_file, mode="wb") as snapshot,
+                gzip.GzipFile(fileobj=index_file, mode="wb") as index,
+            ):
+
+                def indexed(features):
+                    for note_id, feature in features:
+                        index.write(f"{note_id}\t{feature}\n".encode())
+                        yield feature
+
+                for chunk in stream_encoded_feature_collection(indexed(features)):
+                    snapshot.write(chunk.encode())
+
+            self.publish(
+                [
+                    (f"{self.directory}/{stem}{self.index_suffix}", index_file),
+                    (f"{self.directory}/{stem}{self.suffix}", snapshot_file),
+                ]
+            )
+
+        latest = self.latest()
+        for old in self.snapshots()[:-1]:
+            self.storage.delete(old.name)
+            self.storage.delete(old.index_name)
+        return latest
+
+    def publish(self, files):
+        """
+        Save the given (name, file) pairs under temporary names, then atomically rename them into place in order.
+        """
+        saved = []
+        try:
+            for name, f in files:
+                saved.append((self.storage.save(f"{name}{self.temporary_suffix}", File(f)), name))
+            for temporary_name, name in saved:
+                os.replace(self.storage.path(temporary_name), self.storage.path(name))
+        finally:
+            for temporary_name, _ in saved:
+                if self.storage.exists(temporary_name):
+                    self.storage.delete(temporary_name)
+
+    def build_if_unlocked(self, full=False):
+        """
+        Build a new snapshot as build() does, unless another thread or process is already building one. Return the new
+        snapshot, or None if a build was already running.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", [self.lock_id])
+            if not cursor.fetchone()[0]:
+                return None
+        try:
+            return self.build(full=full)
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", [self.lock_id])
+
+    def build_in_background(self):
+        """
+        Start building a new snapshot in the background, unless a build is already running.
+        """
+        run_in_background(self.build_if_unlocked)
@@ -1,3 +1,5 @@
+import json
+
 from django.contrib.auth.models import User
 from rest_framework.test import APITestCase
 
@@ -12,6 +14,12 @@ class FVHAPITestCase(APITestCase):
             else:
                 assert received == expected, f"Value mismatch for key {full_path}: {expected} != {received}"
 
+    def streamed_content(self, response):
+        return b"".join(response.streaming_content)
+
+    def streamed_json(self, response):
+        return json.loads(self.streamed_content(response))
+
     def create_user(self):
         return User.objects.create(
             username="courier", first_name="Coranne", last_name="Courier", email="coranne@couriersrus.com"
@@ -1,9 +1,25 @@
 import json
-
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from io import StringIO
+from unittest.mock import Mock, patch
+
+import numpy as np
+import overpy
+from django.core.management import call_command
+from django.test import TransactionTestCase
 from django.urls import reverse
+from django.utils import timezone
+from geopy.distance import distance as geodesic_distance
+from overpy.exception import OverpassTooManyRequests
 from rest_framework import status
 
 from olmap import models
+from olmap.distance import haversine
+from olmap.models.map_features import link_notes, link_notes_to_osm_objects
+from olmap.osm_sources import ExtractSource, OverpassSource
+from olmap.translation import get_translation_cache
 
 from ..serializers.workplace_wizard import example_workplace
 from .base import FVHAPITestCase
@@ -117,6 +133,47 @@ class OSMMapFeatureTests(FVHAPITestCase):
         # And any passed layer info is saved to the note:
         self.assertEqual(note.layer, -1)
 
+    def test_update_osm_image_note_map_features_in_bulk(self):
+        # Given that a user is signed in
+        user = self.create_and_login_user()
+
+        # And given an OSM image note with two gates
+        note = models.OSMImageNote.objects.create(lat="60.16134701761975", lon="24.944593941327188", created_by=user)
+        kept_gate = note.gate_set.create(height="3.5")
+        removed_gate = note.gate_set.create(height="2.5")
+
+        # When requesting to update the gates of the note, keeping and changing one, adding one and dropping one
+        url = reverse("osmimagenote-detail", kwargs={"pk": note.id})
+        fields = {"gate_set": [{"id": kept_gate.id, "height": "3.2"}, {"height": "2.8", "lift_gate": True}]}
+        response = self.client.patch(url, data=fields, format="json")
+
+        # Then an OK response is received:
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # And the gates have been changed:
+        gates = note.gate_set.order_by("id")
+        self.assertEqual([(g.id, str(g.height), g.lift_gate) for g in gates[:1]], [(kept_gate.id, "3.20", False)])
+        self.assertEqual([(str(g.height), g.lift_gate) for g in gates[1:]], [("2.80", True)])
+        self.assertFalse(models.Gate.objects.filter(id=removed_gate.id).exists())
+
+        # And the response contains the gates as saved:
+        self.assertEqual([g["id"] for g in response.json()["gate_set"]], [g.id for g in gates])
+
+        # And the height limit of the note is updated:
+        note.refresh_from_db()
+        self.assertEqual(str(note.height_limit), "2.80")
+
+        # And when requesting to update the gates, referring to a gate not in the note
+        fields = {"gate_set": [{"height": "2.0"}, {"id": removed_gate.id, "height": "2.1"}]}
+        response = self.client.patch(url, data=fields, format="json")
+
+        # Then a bad request response is received:
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # And none of the changes are saved:
+        self.assertEqual(note.gate_set.count(), 2)
+        self.assertFalse(note.gate_set.filter(height="2.0").exists())
+
     def test_osm_image_note_map_feature_schemas(self):
         # Given that a user is signed in
         self.create_and_login_user()
@@ -363,6 +420,7 @@ class OSMMapFeatureTests(FVHAPITestCase):
                     "lon": 24.94928504,
                     "osm_feature": 7271539738,
                     "deliveries": "main",
+                    "description": "Back door",
                     "unloading_places": [
                         {
                             "lat": 60.16605062,
@@ -379,10 +437,12 @@ class OSMMapFeatureTests(FVHAPITestCase):
             ),
         }
 
-        # When POSTing data for a new workplace, along with entrances, unloading places and access points:
-        response = self.client.post(url, json.dumps(data), content_type="application/json")
+        # When POSTing data for a new workplace, along with entrances, unloading places and access points,
+        # Then the whole tree is written with one bulk write per table and represented without reloading it:
+        with self.assertNumQueries(16):
+            response = self.client.post(url, json.dumps(data), content_type="application/json")
 
-        # Then an OK response is received:
+        # And an OK response is received:
         self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.content)
 
         # And the response contains the created workplace, entrances, unloading places and access points:
@@ -410,6 +470,10 @@ class OSMMapFeatureTests(FVHAPITestCase):
 
         unloading_places = entrances[0].get("unloading_places", [])
         self.assertEqual(len(unloading_places), 2)
+        self.assertEqual([up["entrances"] for up in unloading_places], [[entrances[0]["entrance_id"]]] * 2)
+
+        # And the entrance is described in the context of the workplace:
+        self.assertEqual(models.Entrance.objects.get().description, "Back door, Zucchini")
 
         self.assert_dict_contains(
             unloading_places[0],
@@ -435,11 +499,20 @@ class OSMMapFeatureTests(FVHAPITestCase):
 
         # And image notes have been created in the db for all created workplaces,
         # entrances and unloading places:
-        notes = models.OSMImageNote.objects.all()
+        notes = models.OSMImageNote.objects.order_by("id")
         self.assertEqual(
             [n.tags for n in notes], [["Workplace"], ["Entrance"], ["UnloadingPlace"], ["UnloadingPlace"], ["Entrance"]]
         )
 
+        # And when PATCHing a workplace entrance or unloading place not of this workplace, a 400 response is received:
+        for entrance_fields in [{"id": 1000}, {**r["workplace_entrances"][0], "unloading_places": [{"id": 1000}]}]:
+            data = {**r, "workplace_entrances": [entrance_fields]}
+            response = self.client.patch(url, json.dumps(data), content_type="application/json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, response.content)
+
+        # And nothing is changed:
+        self.assertEqual(models.WorkplaceEntrance.objects.count(), 2)
+
     def test_workplace_api_example(self):
         url = reverse("workplace-list")
         data = example_workplace
@@ -449,3 +522,317 @@ class OSMMapFeatureTests(FVHAPITestCase):
 
         # Then an OK response is received:
         self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.content)
+
+    def test_translations_cached(self):
+        # Given an empty translation cache using the fake translation backend
+        get_translation_cache.cache_clear()
+        backend = get_translation_cache().backend
+
+        # When saving a workplace with delivery instructions for the workplace and one of its entrances
+        note = models.OSMImageNote.objects.create(lat="60.16000000", lon="24.94000000")
+        workplace_type = models.WorkplaceType.objects.create(label="Shop", osm_tags={"shop": "yes"})
+        with self.captureOnCommitCallbacks(execute=True):
+            workplace = note.workplace_set.create(type=workplace_type, delivery_instructions="Soita ovikelloa")
+            entrance = note.entrance_set.create()
+            workplace.workplace_entrances.create(entrance=entrance, delivery_instructions="Lastauslaiturin kautta")
+
+        # Then the delivery instructions are translated in the background:
+        self.assertEqual(backend.calls, [["Soita ovikelloa"], ["Lastauslaiturin kautta"]])
+
+        # And when requesting the workplace in English, even after the in-memory cache is cleared
+        url = reverse("workplace_with_note-detail", kwargs={"pk": workplace.id})
+        self.client.get(url, {"language": "en"})
+        get_translation_cache().clear()
+        response = self.client.get(url, {"language": "en"})
+
+        # Then the stored translations are returned without calling the translation backend again:
+        self.assertEqual(response.json()["delivery_instructions_translated"], "[en] Soita ovikelloa")
+        entrance_instructions = response.json()["workplace_entrances"][0]["delivery_instructions_translated"]
+        self.assertEqual(entrance_instructions, "[en] Lastauslaiturin kautta")
+        self.assertEqual(len(backend.calls), 2)
+
+        # And when the instructions were changed without translating them, e.g. in a bulk update
+        models.Workplace.objects.update(delivery_instructions="Soita kahdesti")
+
+        # Then requests are served without waiting for the translation, which is made for the next request:
+        response = self.client.get(url, {"language": "en"})
+        self.assertIsNone(response.json()["delivery_instructions_translated"])
+        self.assertEqual(backend.calls[2:], [["Soita kahdesti"]])
+        response = self.client.get(url, {"language": "en"})
+        self.assertEqual(response.json()["delivery_instructions_translated"], "[en] Soita kahdesti")
+
+        # And when requesting the workplace concurrently in a language not translated into when saving
+        jobs = []
+        with patch("olmap.translation.run_in_background", lambda *args: jobs.append(args)):
+            for _i in range(2):
+                response = self.client.get(url, {"language": "sv"})
+                self.assertIsNone(response.json()["delivery_instructions_translated"])
+
+        # Then the texts are translated for the next requests in a single background job:
+        self.assertEqual(len(jobs), 1)
+        func, *args = jobs[0]
+        func(*args)
+        response = self.client.get(url, {"language": "sv"})
+        self.assertEqual(response.json()["delivery_instructions_translated"], "[sv] Soita kahdesti")
+
+    def test_entrances_near(self):
+        # Given entrances at about 0m, 55m, 165m and 550m north of a position
+        entrances = []
+        for lat in ["60.16000000", "60.16050000", "60.16150000", "60.16500000"]:
+            note = models.OSMImageNote.objects.create(lat=lat, lon="24.94000000")
+            entrances.append(note.entrance_set.create())
+
+        # When requesting the entrances near the position
+        url = reverse("entrance-near")
+        response = self.client.get(url, {"lat": "60.16001", "lon": "24.94"})
+
+        # Then the entrances within 100m are returned, nearest first:
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([e["id"] for e in response.json()], [entrances[0].id, entrances[1].id])
+
+        # And when requesting entrances within a larger radius, the farther ones are included:
+        response = self.client.get(url, {"lat": "60.16151", "lon": "24.94", "radius": "1000"})
+        self.assertEqual([e["id"] for e in response.json()], [entrances[i].id for i in [2, 1, 0, 3]])
+
+        # And when requesting entrances within an invalid radius, a 400 response is received:
+        response = self.client.get(url, {"lat": "60.16151", "lon": "24.94", "radius": "100000"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_entrances_near_in_southern_hemisphere(self):
+        # Given an entrance far in the south, just within 1000m east of a position, where the circle is the widest
+        note = models.OSMImageNote.objects.create(lat="-80.00000000", lon="24.05178000")
+        entrance = note.entrance_set.create()
+
+        # When requesting the entrances within 1000m of the position
+        url = reverse("entrance-near")
+        response = self.client.get(url, {"lat": "-80", "lon": "24", "radius": "1000"})
+
+        # Then the entrance is returned:
+        self.assertEqual([e["id"] for e in response.json()], [entrance.id])
+
+    def test_link_notes_to_osm_objects(self):
+        # Given gates near OSM gate nodes, one of them matching by tags and distance and one not
+        linked = models.OSMImageNote.objects.create(lat="60.16000000", lon="24.94000000")
+        linked_gate = linked.gate_set.create()
+        unmatched = models.OSMImageNote.objects.create(lat="60.17000000", lon="24.94000000")
+        unmatched.gate_set.create(lift_gate=True)
+        nodes = [
+            {"type": "node", "id": 1001, "lat": 60.16001, "lon": 24.94, "tags": {"barrier": "gate"}},
+            {"type": "node", "id": 1002, "lat": 60.17001, "lon": 24.94, "tags": {"barrier": "gate"}},
+        ]
+
+        # When linking the gates to OSM nodes read from a local extract
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "extract.json")
+            with open(path, "w") as f:
+                json.dump({"elements": nodes}, f)
+            with self.assertNumQueries(7):
+                counts = models.Gate.link_notes_to_osm_objects(source=ExtractSource(path))
+
+        # Then the matching gate and its note are linked to the OSM node in bulk:
+        self.assertEqual(counts, {"linked": 1, "skipped": 1})
+        linked_gate.refresh_from_db()
+        self.assertEqual(linked_gate.osm_feature_id, 1001)
+        self.assertEqual([f.id for f in linked.osm_features.all()], [1001])
+        self.assertEqual(unmatched.osm_features.count(), 0)
+
+    def test_link_all_types_from_a_single_fetch(self):
+        # Given a gate and an entrance near matching OSM nodes on Overpass
+        gate_note = models.OSMImageNote.objects.create(lat="60.16000000", lon="24.94000000")
+        gate = gate_note.gate_set.create()
+        entrance_note = models.OSMImageNote.objects.create(lat="60.17000000", lon="24.94000000")
+        entrance = entrance_note.entrance_set.create(street="Mannerheimintie", housenumber="1", type="main")
+        nodes = [
+            {"type": "node", "id": 1001, "lat": 60.16001, "lon": 24.94, "tags": {"barrier": "gate"}},
+            {"type": "node", "id": 1002, "lat": 60.17001, "lon": 24.94, "tags": {"entrance": "main"}},
+        ]
+        api = Mock()
+        api.query.return_value = overpy.Result.from_json({"elements": nodes})
+
+        # When linking map features of all types to OSM
+        counts = link_notes_to_osm_objects(source=OverpassSource(api=api))
+
+        # Then the nodes of all types are fetched in a single query and each feature linked to the node of its type:
+        self.assertEqual(api.query.call_count, 1)
+        self.assertEqual(counts["Gate"], {"linked": 1, "skipped": 0})
+        self.assertEqual(counts["Entrance"], {"linked": 1, "skipped": 0})
+        gate.refresh_from_db()
+        entrance.refresh_from_db()
+        self.assertEqual([gate.osm_feature_id, entrance.osm_feature_id], [1001, 1002])
+
+    def test_osm_node_candidates(self):
+        # Given two notes and OSM nodes at various distances from them
+        notes = np.array([[60.16, 24.94], [60.17, 24.94]])
+        nodes = np.array([[60.1601, 24.94], [60.16001, 24.94], [60.179, 24.94], [60.16, 24.9401]])
+
+        # When finding the candidate nodes of the notes in bulk
+        note_indices, node_indices, distances = models.Gate.osm_node_candidates(notes, nodes)
+
+        # Then each note gets the nodes within the search radius sorted by distance, or else just its nearest node:
+        self.assertEqual(note_indices.tolist(), [0, 0, 0, 1])
+        self.assertEqual(node_indices.tolist(), [1, 3, 0, 2])
+        self.assertEqual(sorted(distances[:3]), distances[:3].tolist())
+
+    def test_incremental_linking(self):
+        # Given a gate that was already checked by the linkers and a new one, both near matching OSM nodes
+        checked = models.OSMImageNote.objects.create(lat="60.16000000", lon="24.94000000").gate_set.create()
+        models.Gate.objects.filter(id=checked.id).update(link_checked_at=timezone.now())
+        new = models.OSMImageNote.objects.create(lat="60.17000000", lon="24.94000000").gate_set.create()
+        nodes = [
+            {"type": "node", "id": 1001, "lat": 60.16001, "lon": 24.94, "tags": {"barrier": "gate"}},
+            {"type": "node", "id": 1002, "lat": 60.17001, "lon": 24.94, "tags": {"barrier": "gate"}},
+        ]
+        api = Mock()
+        api.query.return_value = overpy.Result.from_json({"elements": nodes})
+
+        # When linking incrementally
+        osm_counts, address_counts = link_notes(source=OverpassSource(api=api), incremental=True)
+
+        # Then only the gate in the link queue is linked and the queue is then empty:
+        self.assertEqual(osm_counts["Gate"], {"linked": 1, "skipped": 0})
+        self.assertEqual(list(models.Gate.objects.exclude(osm_feature=None).values_list("id", flat=True)), [new.id])
+        self.assertEqual(models.Gate.link_queue().count(), 0)
+
+        # And when linking incrementally again with nothing queued
+        link_notes(source=OverpassSource(api=api), incremental=True)
+
+        # Then OSM is not queried again:
+        self.assertEqual(api.query.call_count, 1)
+
+        # And when a gate is saved again, it is queued for linking:
+        checked.save()
+        self.assertEqual(list(models.Gate.link_queue()), [checked])
+
+    def test_features_committed_during_linking_stay_queued(self):
+        # Given a gate saved before linking starts but committed only after the linkers have read their candidates
+        saved_at = timezone.now()
+        late = []
+
+        def commit_late_gate(*args, **kwargs):
+            note = models.OSMImageNote.objects.create(lat="60.16000000", lon="24.94000000")
+            late.append(note.gate_set.create())
+            models.Gate.objects.filter(id=late[0].id).update(modified_at=saved_at)
+            return {}
+
+        # When linking incrementally
+        with patch("olmap.models.map_features.link_notes_to_official_address", commit_late_gate):
+            link_notes(source=OverpassSource(api=Mock()), incremental=True)
+
+        # Then the gate is left in the link queue for the next run:
+        self.assertEqual(list(models.Gate.link_queue()), late)
+
+    def test_link_osm_command(self):
+        # Given a gate near a matching OSM node in a local extract
+        gate = models.OSMImageNote.objects.create(lat="60.16000000", lon="24.94000000").gate_set.create()
+        nodes = [{"type": "node", "id": 1001, "lat": 60.16001, "lon": 24.94, "tags": {"barrier": "gate"}}]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "extract.json")
+            with open(path, "w") as f:
+                json.dump({"elements": nodes}, f)
+            args = ["link_osm", "--source=file", "--file", path, "--types", "Gate", "--workers", "1"]
+
+            # When running the link_osm command as a dry run
+            out = StringIO()
+            call_command(*args, "--dry-run", stdout=out)
+
+            # Then it reports the link it would make along with the time spent per phase, but writes nothing:
+            self.assertIn("Gate: 1 would be linked to OSM, 0 without a match", out.getvalue())
+            self.assertRegex(out.getvalue(), r"fetch: [\d.]+s index: [\d.]+s match: [\d.]+s write: [\d.]+s")
+            gate.refresh_from_db()
+            self.assertIsNone(gate.osm_feature_id)
+            self.assertEqual(models.Gate.link_queue().count(), 1)
+
+            # And when running it for real
+            call_command(*args, stdout=StringIO())
+
+        # Then the gate is linked and no longer queued:
+        gate.refresh_from_db()
+        self.assertEqual(gate.osm_feature_id, 1001)
+        self.assertEqual(models.Gate.link_queue().count(), 0)
+
+    def test_overpass_source_caches_responses(self):
+        # Given an Overpass source with a response cache
+        nodes = [{"type": "node", "id": 1001, "lat": 60.16001, "lon": 24.94, "tags": {"barrier": "gate"}}]
+        api = Mock()
+        api.query.return_value = overpy.Result.from_json({"elements": nodes})
+        with tempfile.TemporaryDirectory() as directory:
+            source = OverpassSource(directory, ttl=60, api=api)
+
+            # When fetching the same nodes twice
+            first = source.nodes("barrier=gate")
+            second = source.nodes("barrier=gate")
+
+            # Then Overpass is queried only once, the second fetch being served from the cache:
+            self.assertEqual(api.query.call_count, 1)
+            self.assertEqual([(n.id, n.lat, n.tags) for n in second], [(n.id, n.lat, n.tags) for n in first])
+
+            # And when the cached response has expired and Overpass refuses further requests
+            source.ttl = -1
+            api.query.side_effect = OverpassTooManyRequests()
+            with patch("olmap.osm_sources.sleep") as sleep:
+                third = source.nodes("barrier=gate")
+
+            # Then the stale response is used without waiting:
+            sleep.assert_not_called()
+            self.assertEqual([n.id for n in third], [1001])
+
+    def test_link_notes_to_official_address(self):
+        # Given official addresses and entrances with housenumbers written in various ways, one of them too far away
+        a3 = models.Address.objects.create(street="Tie", housenumber="3", city="Helsinki", lat=60.16, lon=24.94)
+        a12b = models.Address.objects.create(street="Tie", housenumber="12b", city="Helsinki", lat=60.16, lon=24.94)
+        models.Address.objects.create(street="Katu", housenumber="1", city="Helsinki", lat=60.2, lon=24.94)
+        range_note = models.OSMImageNote.objects.create(lat="60.16001000", lon="24.94000000")
+        range_note.entrance_set.create(street="Tie", housenumber="1-3")
+        letter_note = models.OSMImageNote.objects.create(lat="60.16001000", lon="24.94000000")
+        letter_note.entrance_set.create(street="tie", housenumber="12 B")
+        far_note = models.OSMImageNote.objects.create(lat="60.16001000", lon="24.94000000")
+        far_note.entrance_set.create(street="Katu", housenumber="1")
+
+        # When linking the notes to official addresses
+        with self.assertNumQueries(6):
+            linked = models.Entrance.link_notes_to_official_address()
+
+        # Then the notes near a matching address are linked to it in bulk:
+        self.assertEqual(linked, 2)
+        self.assertEqual(list(range_note.addresses.all()), [a3])
+        self.assertEqual(list(letter_note.addresses.all()), [a12b])
+        self.assertEqual(far_note.addresses.count(), 0)
+
+    def test_haversine_matches_geodesic_distance(self):
+        # Given pairs of points at distances typical for linking notes, from a meter to a few kilometers
+        origin = (60.16952, 24.93545)
+        points = [(60.16953, 24.93546), (60.1705, 24.9358), (60.17, 24.9), (60.2, 24.95), (60.15, 24.99)]
+
+        # When computing their distances from the origin in one call
+        lats, lons = zip(*points, strict=True)
+        distances = haversine(*origin, lats, lons)
+
+        # Then they are within 0.5% of the geodesic distances computed by geopy:
+        for point, dst in zip(points, distances, strict=True):
+            self.assertAlmostEqual(dst, geodesic_distance(origin, point).meters, delta=dst * 0.005)
+
+
+class ParallelLinkingTests(TransactionTestCase):
+    def test_link_types_in_worker_processes(self):
+        # Given a gate and an entrance near matching OSM nodes, committed so that worker processes can read them
+        gate = models.OSMImageNote.objects.create(lat="60.16000000", lon="24.94000000").gate_set.create()
+        entrance_note = models.OSMImageNote.objects.create(lat="60.17000000", lon="24.94000000")
+        entrance = entrance_note.entrance_set.create(street="Mannerheimintie", housenumber="1", type="main")
+        nodes = [
+            {"type": "node", "id": 1001, "lat": 60.16001, "lon": 24.94, "tags": {"barrier": "gate"}},
+            {"type": "node", "id": 1002, "lat": 60.17001, "lon": 24.94, "tags": {"entrance": "main"}},
+        ]
+        api = Mock()
+        api.query.return_value = overpy.Result.from_json({"elements": nodes})
+
+        # When linking map features of all types to OSM in two worker processes
+        with patch("olmap.models.map_features.ProcessPoolExecutor", wraps=ProcessPoolExecutor) as executor:
+            counts = link_notes_to_osm_objects(source=OverpassSource(api=api), workers=2)
+
+        # Then the types are linked in two worker processes, each feature to the node of its type:
+        self.assertEqual(executor.call_args.kwargs["max_workers"], 2)
+        self.assertEqual(counts["Gate"], {"linked": 1, "skipped": 0})
+        self.assertEqual(counts["Entrance"], {"linked": 1, "skipped": 0})
+        gate.refresh_from_db()
+        entrance.refresh_from_db()
+        self.assertEqual([gate.osm_feature_id, entrance.osm_feature_id], [1001, 1002])
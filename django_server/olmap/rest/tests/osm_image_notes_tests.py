@@ -1,12 +1,32 @@
+import gzip
+import json
 import os
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest.mock import patch
 
+import mapbox_vector_tile
+from django.conf import settings
 from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from PIL import ExifTags, Image
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 
 from olmap import models
+from olmap.images import derivative_name, strip_jpeg_metadata
+from olmap.rest.geojson import point_feature
 from olmap.rest.permissions import REVIEWER_GROUP
+from olmap.rest.serializers import DictOSMImageNoteSerializer
+from olmap.rest.snapshots import FullGeoJSONSnapshot
 
 from .base import FVHAPITestCase
 
@@ -100,6 +120,152 @@ class OSMImageNotesTests(FVHAPITestCase):
         note = models.OSMImageNote.objects.get()
         self.assertEqual(note.image.name, f"osm_image_notes/{note.id}/image.png")
 
+    def test_image_processed_in_background(self):
+        # Given an image note and a sideways photo with EXIF orientation and GPS data
+        note = models.OSMImageNote.objects.create(lat="60.16134702", lon="24.94459394")
+        photo = Image.new("RGB", (40, 20))
+        exif = photo.getexif()
+        exif[ExifTags.Base.Orientation] = 6
+        exif[ExifTags.Base.GPSInfo] = {ExifTags.GPS.GPSLatitudeRef: "N"}
+        file = BytesIO()
+        photo.save(file, format="JPEG", exif=exif)
+
+        # When uploading the photo to the note
+        uploaded_file = SimpleUploadedFile("photo.jpg", file.getvalue(), content_type="image/jpeg")
+        url = reverse("osmimagenote-detail", kwargs={"pk": note.id})
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(url, data={"image": uploaded_file}, format="multipart")
+
+            # Then the original is stored right away, pending processing:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json()["image_status"], "pending")
+
+        # And it is then rotated upright and stripped of EXIF data in the background:
+        note.refresh_from_db()
+        self.assertEqual(note.image_status, "ready")
+        with note.image.open() as f:
+            image = Image.open(f)
+            self.assertEqual(image.size, (20, 40))
+            self.assertFalse(image.getexif())
+
+        # And downscaled derivatives are generated next to it and exposed in the API:
+        self.assertEqual(note.image_sizes, ["thumbnail", "medium", "full"])
+        response = self.client.get(url)
+        self.assertEqual(
+            response.json()["image_derivatives"]["thumbnail"], f"/uploads/osm_image_notes/{note.id}/photo_thumbnail.jpg"
+        )
+
+    def test_image_processed_only_when_changed(self):
+        # Given an upright photo with EXIF data
+        photo = Image.effect_noise((64, 48), 64).convert("RGB")
+        exif = photo.getexif()
+        exif[ExifTags.Base.Orientation] = 1
+        exif[ExifTags.Base.Make] = "Phone"
+        file = BytesIO()
+        photo.save(file, format="JPEG", exif=exif)
+
+        # When it is uploaded to an image note
+        note = models.OSMImageNote(lat="60.16134702", lon="24.94459394")
+        note.image = SimpleUploadedFile("photo.jpg", file.getvalue(), content_type="image/jpeg")
+        with self.captureOnCommitCallbacks(execute=True):
+            note.save()
+
+        # Then its EXIF data is stripped without re-encoding the image:
+        note.refresh_from_db()
+        with note.image.open() as f:
+            image = Image.open(f)
+            self.assertFalse(image.getexif())
+            self.assertEqual(image.tobytes(), Image.open(file).tobytes())
+
+        # And when the note is saved again without changing the image, e.g. when reviewing it
+        with patch.object(models.OSMImageNote, "process_image") as process_image:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                note.visible = False
+                note.save()
+
+        # Then the image is not processed again:
+        self.assertEqual(callbacks, [])
+        process_image.assert_not_called()
+
+    def test_phone_photo_processed_losslessly(self):
+        # Given an upright photo with EXIF data saved as MPO, i.e. JPEG with further images appended, as by many phones
+        photo = Image.effect_noise((64, 48), 64).convert("RGB")
+        exif = photo.getexif()
+        exif[ExifTags.Base.Make] = "Phone"
+        file = BytesIO()
+        photo.save(file, format="MPO", save_all=True, append_images=[photo.copy()], exif=exif)
+
+        # When it is uploaded to an image note
+        note = models.OSMImageNote(lat="60.16134702", lon="24.94459394")
+        note.image = SimpleUploadedFile("photo.jpg", file.getvalue(), content_type="image/jpeg")
+        with self.captureOnCommitCallbacks(execute=True):
+            note.save()
+
+        # Then the primary image is kept as a plain JPEG without EXIF data, without re-encoding it:
+        note.refresh_from_db()
+        self.assertEqual(note.image_status, "ready")
+        with note.image.open() as f:
+            image = Image.open(f)
+            self.assertEqual(image.format, "JPEG")
+            self.assertFalse(image.getexif())
+            self.assertEqual(image.tobytes(), Image.open(file).tobytes())
+
+        # And truncated JPEG data is rejected as invalid:
+        for data in [b"\xff\xd8\xff", b"\xff\xd8\xff\xe1\x00\x10", file.getvalue()[:200]]:
+            with self.assertRaises(ValueError):
+                strip_jpeg_metadata(data)
+
+    def test_generate_image_derivatives(self):
+        # Given an image note with an image uploaded before derivatives were generated
+        note = models.OSMImageNote.objects.create(lat="60.16134702", lon="24.94459394")
+        file = BytesIO()
+        Image.new("RGB", (1000, 500)).save(file, format="PNG")
+        name = default_storage.save(f"osm_image_notes/{note.id}/photo.png", file)
+        models.OSMImageNote.objects.filter(id=note.id).update(image=name, image_status="ready")
+
+        # When generating the derivatives of existing images
+        out = StringIO()
+        call_command("generate_image_derivatives", stdout=out)
+
+        # Then the derivatives of the image are generated, none larger than the original:
+        self.assertEqual(out.getvalue().strip(), "Processed the images of 1 image notes, 0 of which failed.")
+        note.refresh_from_db()
+        self.assertEqual(note.image_sizes, ["thumbnail", "medium", "full"])
+        sizes = {}
+        for size in note.image_sizes:
+            with default_storage.open(derivative_name(name, size)) as f:
+                sizes[size] = Image.open(f).size
+        self.assertEqual(sizes, {"thumbnail": (256, 128), "medium": (1000, 500), "full": (1000, 500)})
+
+    def test_process_pending_images(self):
+        # Given an image note whose image was left pending an hour ago, e.g. by a restart, and one uploaded just now
+        file = BytesIO()
+        Image.new("RGB", (100, 50)).save(file, format="PNG")
+        notes = []
+        for _i in range(2):
+            note = models.OSMImageNote.objects.create(lat="60.16134702", lon="24.94459394")
+            name = default_storage.save(f"osm_image_notes/{note.id}/photo.png", BytesIO(file.getvalue()))
+            models.OSMImageNote.objects.filter(id=note.id).update(image=name, image_status="pending")
+            notes.append(note)
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        models.OSMImageNote.objects.filter(id=notes[0].id).update(modified_at=an_hour_ago)
+
+        # When processing pending images
+        out = StringIO()
+        call_command("process_pending_images", stdout=out)
+
+        # Then only the image left pending is processed:
+        self.assertEqual(out.getvalue().strip(), "Processed the pending images of 1 image notes, 0 of which failed.")
+        statuses = [models.OSMImageNote.objects.get(id=note.id).image_status for note in notes]
+        self.assertEqual(statuses, ["ready", "pending"])
+
+        # And when processing an image fails unexpectedly
+        with patch("olmap.models.osm_image_notes.normalized_image", side_effect=IndexError), self.assertLogs():
+            models.OSMImageNote.process_image(notes[1].id)
+
+        # Then the image is marked failed rather than left pending:
+        self.assertEqual(models.OSMImageNote.objects.get(id=notes[1].id).image_status, "failed")
+
     def test_save_osm_image_note_with_no_features(self):
         # Given that a user is signed in
         self.create_and_login_user()
@@ -220,6 +386,43 @@ class OSMImageNotesTests(FVHAPITestCase):
         note = models.OSMImageNote.objects.get()
         self.assertEqual(note.reviewed_by_id, user.id)
 
+    def test_reviewer_groups_loaded_once(self):
+        # Given that a reviewer user is signed in
+        user = self.create_and_login_reviewer()
+        note = models.OSMImageNote.objects.create(lat="60.16134701761975", lon="24.944593941327188")
+
+        # When requesting to mark a note as reviewed, requiring a reviewer both to access and to serialize the note
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(reverse("osmimagenote-mark-reviewed", kwargs={"pk": note.id}))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # Then the groups of the user are loaded only once:
+        group_queries = [q for q in queries.captured_queries if '"auth_user_groups"' in q["sql"]]
+        self.assertEqual(len(group_queries), 1)
+
+        # And when the user is removed from the reviewer group
+        user.groups.clear()
+
+        # Then the user is no longer allowed to review notes:
+        response = self.client.put(reverse("osmimagenote-mark-reviewed", kwargs={"pk": note.id}))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(USER_GROUPS_CACHE_TTL=300)
+    def test_reviewer_groups_revoked_in_other_process(self):
+        # Given that a reviewer user is signed in and has reviewed a note, with the per process default cache
+        user = self.create_and_login_reviewer()
+        note = models.OSMImageNote.objects.create(lat="60.16134701761975", lon="24.944593941327188")
+        response = self.client.put(reverse("osmimagenote-mark-reviewed", kwargs={"pk": note.id}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # When the user is removed from the reviewer group by another process, without clearing the cache of this one
+        with patch("olmap.rest.permissions.forget_group_names"):
+            user.groups.clear()
+
+        # Then the user is no longer allowed to review notes:
+        response = self.client.put(reverse("osmimagenote-mark-reviewed", kwargs={"pk": note.id}))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
     def test_hide_features(self):
         # Given that a reviewer user is signed in
         user = self.create_and_login_reviewer()
@@ -331,9 +534,10 @@ class OSMImageNotesTests(FVHAPITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
         # And it contains the notes as geojson:
-        props = response.json()["features"][0]["properties"]
+        geojson = self.streamed_json(response)
+        props = geojson["features"][0]["properties"]
         self.assertDictEqual(
-            response.json(),
+            geojson,
             {
                 "type": "FeatureCollection",
                 "features": [
@@ -371,4 +575,434 @@ class OSMImageNotesTests(FVHAPITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
         # And it does not contain the invisible notes:
-        self.assertDictEqual(response.json(), {"type": "FeatureCollection", "features": []})
+        self.assertDictEqual(self.streamed_json(response), {"type": "FeatureCollection", "features": []})
+
+    def test_streamed_geojson_matches_rendered_response(self):
+        # Given that there are a number of OSM image notes in the db
+        for i in range(5):
+            models.OSMImageNote.objects.create(
+                lat=f"60.1613470{i}", lon="24.944593941327188", comment=f"Näkymä {i}\u2028", tags=["Entrance"]
+            )
+
+        # When requesting the notes as geojson
+        url = reverse("osm_image_notes_geojson")
+        response = self.client.get(url)
+
+        # Then the response is streamed:
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+
+        # And its content is identical to rendering the whole feature collection at once:
+        serializer = DictOSMImageNoteSerializer()
+        notes = models.OSMImageNote.objects.filter(visible=True).values()
+        expected = {
+            "type": "FeatureCollection",
+            "features": [point_feature(n["lon"], n["lat"], serializer.to_representation(n)) for n in notes.iterator()],
+        }
+        self.assertEqual(self.streamed_content(response), JSONRenderer().render(expected))
+
+    def test_osm_image_notes_in_viewport(self):
+        # Given that there are OSM image notes in and outside of a particular map viewport
+        inside = models.OSMImageNote.objects.create(lat="60.16134701761975", lon="24.944593941327188")
+        models.OSMImageNote.objects.create(lat="60.17134701761975", lon="24.944593941327188")
+
+        # When requesting the notes within a bounding box
+        url = reverse("osmimagenote-list")
+        response = self.client.get(url, {"bbox": "24.94,60.16,24.95,60.165"})
+
+        # Then only the notes within the bounding box are returned:
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([n["id"] for n in response.json()], [inside.id])
+
+        # And when requesting the notes within a slippy map tile as geojson
+        url = reverse("osm_image_notes_geojson")
+        response = self.client.get(url, {"z": 14, "x": 9327, "y": 4743})
+
+        # Then only the notes within the tile are returned:
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([f["properties"]["id"] for f in self.streamed_json(response)["features"]], [inside.id])
+
+        # And when requesting the notes with an invalid bounding box or tile
+        for params in [{"bbox": "24.94,60.16,24.95"}, {"bbox": "24.95,60.16,24.94,60.165"}, {"z": 2, "x": 4, "y": 0}]:
+            response = self.client.get(url, params)
+
+            # Then a 400 response is received:
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+    def test_osm_image_notes_as_vector_tiles(self):
+        # Given that there are some OSM image notes in the db, one of them with a height limit
+        cache.clear()
+        note = models.OSMImageNote.objects.create(
+            lat="60.16134701761975", lon="24.944593941327188", tags=["Entrance", "Gate"]
+        )
+        note.gate_set.create(height="2.5")
+        models.OSMImageNote.objects.create(
+            lat="60.16135701761975", lon="24.944593941327188", reviewed_by=self.create_user()
+        )
+        models.OSMImageNote.objects.create(lat="60.16135701761975", lon="24.944593941327188", visible=False)
+
+        # When requesting a vector tile containing the notes on a high zoom level
+        url = reverse("image_note_tile", kwargs={"z": 16, "x": 37309, "y": 18972})
+        response = self.client.get(url)
+
+        # Then an OK response is received:
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/vnd.mapbox-vector-tile")
+
+        # And it contains the visible notes with their properties:
+        features = mapbox_vector_tile.decode(response.content)["osm_image_notes"]["features"]
+        self.assertEqual(
+            sorted([f["properties"] for f in features], key=len),
+            [
+                {"is_reviewed": True, "delivery_instructions": False},
+                {"tags": "Entrance,Gate", "is_reviewed": False, "delivery_instructions": False, "height": 2.5},
+            ],
+        )
+
+        # And when requesting the same tile again, it is served from the cache using a single query:
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).content, response.content)
+
+        # And when requesting a tile on a low zoom level
+        url = reverse("image_note_tile", kwargs={"z": 10, "x": 582, "y": 296})
+        response = self.client.get(url)
+
+        # Then the notes are clustered:
+        features = mapbox_vector_tile.decode(response.content)["clusters"]["features"]
+        self.assertEqual([f["properties"] for f in features], [{"point_count": 2}])
+
+        # And when requesting a tile that does not exist, a 400 response is received:
+        url = reverse("image_note_tile", kwargs={"z": 1, "x": 2, "y": 0})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {"tile": "x and y must be between 0 and 1 on zoom level 1."})
+
+    def test_osm_image_note_height_limit(self):
+        # Given an OSM image note with a gate
+        note = models.OSMImageNote.objects.create(lat="60.16134701761975", lon="24.944593941327188")
+        gate = note.gate_set.create()
+        self.assertIsNone(models.OSMImageNote.objects.get().height_limit)
+
+        # When the height of the gate is saved
+        gate.height = "2.5"
+        gate.save()
+
+        # Then the height limit is stored on the note:
+        self.assertEqual(str(models.OSMImageNote.objects.get().height_limit), "2.50")
+
+        # And when the gate is saved again without changing its height, or saving only other fields
+        gate = models.Gate.objects.get()
+        with CaptureQueriesContext(connection) as queries:
+            gate.access = "yes"
+            gate.save()
+            gate.height = "3"
+            gate.save(update_fields=["access"])
+
+        # Then the height limits are not recomputed, only the gate saved and its note touched each time:
+        self.assertEqual(len(queries), 4)
+        self.assertEqual(str(models.OSMImageNote.objects.get().height_limit), "2.50")
+
+        # And when a workplace with a max vehicle height is added to the note
+        workplace_type = models.WorkplaceType.objects.create(label="Shop", osm_tags={"shop": "yes"})
+        workplace = note.workplace_set.create(type=workplace_type, max_vehicle_height="2.2")
+
+        # Then the workplace height limit takes precedence:
+        self.assertEqual(str(models.OSMImageNote.objects.get().height_limit), "2.20")
+
+        # And when requesting the notes, the height limit is returned without querying the map features, i.e.
+        # using only the version and list queries:
+        url = reverse("osmimagenote-list")
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(response.json()[0]["height"], 2.2)
+
+        # And when the workplace and gate are deleted, the height limit is cleared:
+        workplace.delete()
+        self.assertEqual(str(models.OSMImageNote.objects.get().height_limit), "2.50")
+        gate.delete()
+        self.assertIsNone(models.OSMImageNote.objects.get().height_limit)
+
+        # And when the stored height limit is out of date, the management command restores it:
+        note.gate_set.create(height="3")
+        models.OSMImageNote.objects.update(height_limit=None)
+        call_command("rebuild_height_index", stdout=StringIO())
+        self.assertEqual(str(models.OSMImageNote.objects.get().height_limit), "3.00")
+
+    def test_conditional_osm_image_note_requests(self):
+        # Given that there are some OSM image notes in the db, one of them with a workplace
+        note = models.OSMImageNote.objects.create(lat="60.16134701761975", lon="24.944593941327188")
+        models.OSMImageNote.objects.create(lat="60.16135701761975", lon="24.944593941327188")
+        workplace_type = models.WorkplaceType.objects.create(label="Shop", osm_tags={"shop": "yes"})
+        workplace = note.workplace_set.create(type=workplace_type)
+
+        for url in [reverse("osmimagenote-list"), reverse("osm_image_notes_geojson")]:
+            # When requesting the notes
+            response = self.client.get(url)
+
+            # Then the response carries an ETag and Last-Modified:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            etag = response["ETag"]
+            self.assertTrue(response["Last-Modified"])
+
+            # And when requesting the notes again with the ETag
+            with self.assertNumQueries(1):
+                response = self.client.get(url, headers={"If-None-Match": etag})
+
+            # Then a 304 response is received using a single query:
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response["ETag"], etag)
+
+            # But not when requesting the notes with only the Last-Modified time, which does not cover all changes:
+            last_modified = self.client.get(url)["Last-Modified"]
+            response = self.client.get(url, headers={"If-Modified-Since": last_modified})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            # And when a map feature of a note changes
+            workplace.delivery_instructions = f"Deliver to {url}"
+            workplace.save()
+
+            # Then the notes are returned again with a new ETag:
+            response = self.client.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(response["ETag"], etag)
+            etag = response["ETag"]
+
+            # And when a note is hidden, the ETag changes again:
+            models.OSMImageNote.objects.filter(id=note.id).update(visible=False)
+            response = self.client.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(response["ETag"], etag)
+            models.OSMImageNote.objects.filter(id=note.id).update(visible=True)
+
+    def test_conditional_osm_image_note_request_after_delete(self):
+        # Given that there are some OSM image notes in the db, which a client has listed
+        note = models.OSMImageNote.objects.create(lat="60.16134701761975", lon="24.944593941327188")
+        models.OSMImageNote.objects.create(lat="60.16135701761975", lon="24.944593941327188")
+        url = reverse("osmimagenote-list")
+        response = self.client.get(url)
+        last_modified = response["Last-Modified"]
+
+        # When the earlier note is deleted, leaving the latest modification time unchanged
+        note.delete()
+
+        # Then requesting the notes modified since the listing returns the remaining notes rather than a 304:
+        response = self.client.get(url, headers={"If-Modified-Since": last_modified})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()), 1)
+
+    def test_osm_image_notes_changed_since(self):
+        # Given that there are some OSM image notes in the db
+        unchanged = models.OSMImageNote.objects.create(lat="60.16134701761975", lon="24.944593941327188")
+        note = models.OSMImageNote.objects.create(lat="60.16135701761975", lon="24.944593941327188")
+        hidden = models.OSMImageNote.objects.create(lat="60.16136701761975", lon="24.944593941327188")
+        entrance = note.entrance_set.create()
+        since = models.OSMImageNote.objects.get(id=note.id).modified_at
+
+        # And that after a particular point in time, a map feature of one note was changed and another one hidden
+        entrance.description = "Main entrance"
+        entrance.save()
+        self.create_and_login_reviewer()
+        url = reverse("osmimagenote-hide-note", kwargs={"pk": hidden.id})
+        self.client.put(url, data={"hidden_reason": "Duplicate"}, format="json")
+
+        # When requesting the notes changed since then
+        url = reverse("osmimagenote-list")
+        response = self.client.get(url, {"changed_since": since.isoformat()})
+
+        # Then only the changed note and a tombstone for the hidden note are returned:
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        notes = sorted(response.json(), key=lambda n: n["id"])
+        self.assertEqual([n["id"] for n in notes], [note.id, hidden.id])
+        self.assertNotIn("visible", notes[0])
+        self.assertEqual(set(notes[1].keys()), {"id", "visible", "modified_at"})
+        self.assertFalse(notes[1]["visible"])
+
+        # And the unchanged note is only returned when requesting all notes:
+        response = self.client.get(url)
+        self.assertEqual(sorted(n["id"] for n in response.json()), [unchanged.id, note.id])
+
+        # And when requesting changes with an invalid timestamp, a 400 response is received:
+        response = self.client.get(url, {"changed_since": "yesterday"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_full_osm_image_notes_geojson_snapshot(self):
+        # Given that there are some OSM image notes in the db and no pre-rendered snapshot of them
+        snapshot = FullGeoJSONSnapshot()
+        for old in snapshot.snapshots():
+            snapshot.storage.delete(old.name)
+            snapshot.storage.delete(old.index_name)
+        note = models.OSMImageNote.objects.create(
+            lat="60.16134701761975", lon="24.944593941327188", image="osm_image_notes/1/image.jpg"
+        )
+        note.entrance_set.create(description="Main entrance")
+        workplace_type = models.WorkplaceType.objects.create(label="Shop", osm_tags={"shop": "yes"})
+        note.workplace_set.create(type=workplace_type, delivery_instructions="Ring the bell")
+        other = models.OSMImageNote.objects.create(lat="60.16135701761975", lon="24.944593941327188")
+        models.OSMImageNote.objects.create(lat="60.16136701761975", lon="24.944593941327188", visible=False)
+
+        # And that a reviewer is signed in
+        self.create_and_login_reviewer()
+
+        # When requesting the full geojson
+        url = reverse("full_osm_image_notes_geojson")
+        response = self.client.get(url)
+
+        # Then the snapshot is built and the visible notes are returned with their map features:
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        geojson = self.streamed_json(response)
+        features = geojson["features"]
+        self.assertEqual([f["properties"]["id"] for f in features], [note.id, other.id])
+        self.assertEqual(features[0]["properties"]["entrance_set"][0]["description"], "Main entrance")
+        self.assertEqual(features[0]["properties"]["workplace_set"][0]["delivery_instructions"], "Ring the bell")
+        self.assertTrue(features[0]["properties"]["delivery_instructions"])
+
+        # And the image urls are absolute, as in other responses:
+        image_url = f"{settings.SITE_URL}/uploads/osm_image_notes/1/image.jpg"
+        self.assertEqual(features[0]["properties"]["image"], image_url)
+
+        # And when requesting it translated, a 400 response is received:
+        self.assertEqual(self.client.get(url, {"language": "en"}).status_code, status.HTTP_400_BAD_REQUEST)
+
+        # And when requesting it with gzip encoding accepted
+        gzipped = self.client.get(url, headers={"Accept-Encoding": "gzip"})
+
+        # Then the snapshot is returned as is, supporting ranges:
+        self.assertEqual(gzipped["Content-Encoding"], "gzip")
+        self.assertEqual(gzipped["Accept-Ranges"], "bytes")
+        content = self.streamed_content(gzipped)
+        self.assertEqual(json.loads(gzip.decompress(content)), geojson)
+
+        # And when requesting a range of it, only that range is returned:
+        response = self.client.get(url, headers={"Accept-Encoding": "gzip", "Range": "bytes=10-19"})
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response["Content-Range"], f"bytes 10-19/{len(content)}")
+        self.assertEqual(self.streamed_content(response), content[10:20])
+
+        response = self.client.get(url, headers={"Accept-Encoding": "gzip", "Range": f"bytes={len(content)}-"})
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+        # And the gzipped snapshot has its own ETag, varying by the accepted encoding:
+        identity = self.client.get(url)
+        self.assertNotEqual(gzipped["ETag"], identity["ETag"])
+        self.assertIn("Accept-Encoding", gzipped["Vary"])
+
+        # And when requesting it with the ETag of the same encoding, a 304 response is received:
+        headers = {"Accept-Encoding": "gzip", "If-None-Match": gzipped["ETag"]}
+        self.assertEqual(self.client.get(url, headers=headers).status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(url, headers={"If-None-Match": identity["ETag"]})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # But not with the ETag of the other encoding:
+        response = self.client.get(url, headers={"If-None-Match": gzipped["ETag"]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # And when a note is changed, the snapshot is rebuilt including the change:
+        note.entrance_set.update(description="Back door")
+        note.entrance_set.get().save()
+        response = self.client.get(url)
+        self.assertNotEqual(response["ETag"], gzipped["ETag"])
+        features = self.streamed_json(response)["features"]
+        self.assertEqual(features[0]["properties"]["entrance_set"][0]["description"], "Back door")
+        self.assertEqual(len(snapshot.snapshots()), 1)
+
+        # And the incrementally built snapshot equals a fully rebuilt one:
+        latest = snapshot.latest()
+        with snapshot.storage.open(latest.name) as f:
+            incremental = gzip.decompress(f.read())
+        with snapshot.storage.open(snapshot.build(full=True).name) as f:
+            self.assertEqual(gzip.decompress(f.read()), incremental)
+
+        # And the snapshot is not stored in the publicly served media storage:
+        self.assertFalse(snapshot.storage.path(latest.name).startswith(settings.MEDIA_ROOT))
+
+        # And while another process is building a snapshot, no other build is started:
+        other_process = connections.create_connection(DEFAULT_DB_ALIAS)
+        with other_process.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_lock(%s)", [snapshot.lock_id])
+        try:
+            self.assertIsNone(snapshot.build_if_unlocked())
+        finally:
+            with other_process.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", [snapshot.lock_id])
+            other_process.close()
+        self.assertTrue(snapshot.build_if_unlocked())
+
+        # And when a non-reviewer requests the full geojson, a 403 response is received:
+        self.client.force_login(self.create_user())
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_half_written_geojson_snapshot_not_listed(self):
+        # Given that there is a snapshot of the image notes
+        snapshot = FullGeoJSONSnapshot()
+        models.OSMImageNote.objects.create(lat="60.16134701761975", lon="24.944593941327188")
+        previous = snapshot.build(full=True)
+
+        # When a new snapshot is being written
+        save = snapshot.storage.save
+        listed = []
+
+        def save_and_list(name, content):
+            saved = save(name, content)
+            listed.append(snapshot.latest())
+            return saved
+
+        models.OSMImageNote.objects.create(lat="60.16135701761975", lon="24.944593941327188")
+        with patch.object(snapshot.storage, "save", side_effect=save_and_list):
+            built = snapshot.build()
+
+        # Then the previous snapshot is the latest one until the new one and its index are complete:
+        self.assertEqual(listed, [previous, previous])
+        self.assertEqual(snapshot.latest(), built)
+        self.assertEqual(built.count, 2)
+
+        # And when writing a snapshot fails, the previous one stays the latest and no partial files are left behind:
+        models.OSMImageNote.objects.create(lat="60.16136701761975", lon="24.944593941327188")
+        with patch("olmap.rest.snapshots.os.replace", side_effect=OSError), self.assertRaises(OSError):
+            snapshot.build()
+        self.assertEqual(snapshot.latest(), built)
+        files = snapshot.storage.listdir(snapshot.directory)[1]
+        self.assertFalse([f for f in files if f.endswith(snapshot.temporary_suffix)])
+
+    def create_note_with_map_features(self, user):
+        note = models.OSMImageNote.objects.create(lat="60.16134701761975", lon="24.944593941327188", created_by=user)
+        note.comments.create(user=user, comment="Nice")
+        note.link_osm_id(len(models.OSMFeature.objects.all()) + 1)
+        entrance = note.entrance_set.create(description="Main entrance")
+        note.gate_set.create(height="2.5")
+        workplace_type, created = models.WorkplaceType.objects.get_or_create(label="Shop", osm_tags={"shop": "yes"})
+        workplace = note.workplace_set.create(type=workplace_type)
+        workplace_entrance = workplace.workplace_entrances.create(entrance=entrance)
+        workplace_entrance.delivery_types.add(models.DeliveryType.objects.get_or_create(name="Parcels")[0])
+        unloading_place = note.unloadingplace_set.create(description="Back yard")
+        unloading_place.entrances.add(entrance)
+        return note
+
+    def test_osm_image_note_query_count(self):
+        # Given an OSM image note with map features of several types, nested relations, comments and OSM features
+        user = self.create_user()
+        note = self.create_note_with_map_features(user)
+
+        # When retrieving the note
+        url = reverse("osmimagenote-detail", kwargs={"pk": note.id})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["workplace_set"][0]["workplace_entrances"][0]["delivery_types"], ["Parcels"])
+
+        # Then the query count does not grow with the number of map features and relations:
+        for _i in range(2):
+            note.entrance_set.create()
+            workplace = note.workplace_set.create(type=note.workplace_set.first().type)
+            workplace.workplace_entrances.create(entrance=note.entrance_set.last())
+            note.comments.create(user=user, comment="Nicer")
+        with self.assertNumQueries(len(queries)):
+            self.client.get(url)
+
+        # And serializing many notes takes as many queries as serializing one:
+        snapshot = FullGeoJSONSnapshot()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(list(snapshot.render(snapshot.get_queryset()))), 1)
+        for _i in range(3):
+            self.create_note_with_map_features(user)
+        with self.assertNumQueries(len(queries)):
+            self.assertEqual(len(list(snapshot.render(snapshot.get_queryset()))), 4)
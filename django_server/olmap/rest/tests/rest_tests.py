@@ -1,6 +1,8 @@
 from django.urls import reverse
 from rest_framework import status
 
+from olmap import models
+
 from .base import FVHAPITestCase
 
 
@@ -35,3 +37,24 @@ class RestAPITests(FVHAPITestCase):
         self.assert_dict_contains(
             response.data, {"first_name": "Coranne", "last_name": "Courier", "username": "courier"}
         )
+
+    def test_nearby_addresses(self):
+        # Given official addresses at about 0m, 55m and 165m north of a position
+        addresses = [
+            models.Address.objects.create(
+                street="Unioninkatu", housenumber=str(i + 1), city="Helsinki", country="FI", lat=lat, lon="24.94"
+            )
+            for i, lat in enumerate(["60.16050000", "60.16000000", "60.16150000"])
+        ]
+
+        # When requesting the addresses near the position
+        url = reverse("nearby_addresses", kwargs={"lat": "60.16", "lon": "24.94"})
+        response = self.client.get(url)
+
+        # Then the addresses within 100m are returned, nearest first:
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([a["tags"]["addr:housenumber"] for a in response.json()], ["2", "1"])
+
+        # And when requesting the addresses within a smaller radius, only the nearest one is returned:
+        response = self.client.get(url, {"radius": "10"})
+        self.assertEqual([a["id"] for a in response.json()], [addresses[1].id])
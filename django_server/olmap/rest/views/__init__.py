@@ -17,10 +17,12 @@ from .osm_image_note import (
     OSMImageNotesViewSet,
 )
 from .recent_mappers import RecentMappersViewSet
+from .tiles import ImageNoteTileView
 
 __all__ = [
     "EntranceViewSet",
     "FullOSMImageNotesGeoJSON",
+    "ImageNoteTileView",
     "NearbyAddressesView",
     "OSMFeaturesViewSet",
     "OSMImageNoteCommentNotificationsViewSet",
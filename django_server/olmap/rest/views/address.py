@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-import math
 from typing import ClassVar
 
 from rest_framework import permissions
@@ -8,12 +7,15 @@ from rest_framework.generics import ListAPIView
 from rest_framework.schemas.openapi import AutoSchema
 
 from olmap import models
+from olmap.rest.filters import parse_radius
 from olmap.rest.serializers import AddressAsOSMNodeSerializer
+from olmap.spatial import within_radius
 
 
 class NearbyAddressesView(ListAPIView):
     """
-    Returns official address points near a specified coordinate, approximately within 100m distance.
+    Returns official address points near a specified coordinate, within 100m distance unless another radius in
+    meters is passed as radius in the query parameters, nearest first.
     The addresses are returned in a format compatible with OSM tagging practice.
     """
 
@@ -23,16 +25,9 @@ class NearbyAddressesView(ListAPIView):
     permission_classes: ClassVar = [permissions.AllowAny]
 
     max_distance_meters = 100
-    m_per_lat = 111200
 
     def get_queryset(self):
         lat = float(self.kwargs["lat"])
         lon = float(self.kwargs["lon"])
-        lat_diff = self.max_distance_meters / self.m_per_lat
-        lon_diff = lat_diff / abs(math.cos(lat * (math.pi / 180)))
-        return self.queryset.filter(
-            lat__gt=lat - lat_diff,
-            lat__lt=lat + lat_diff,
-            lon__gt=lon - lon_diff,
-            lon__lt=lon + lon_diff,
-        )
+        radius = parse_radius(self.request, default=self.max_distance_meters)
+        return within_radius(self.queryset, lat, lon, radius)
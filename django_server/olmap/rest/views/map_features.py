@@ -2,7 +2,6 @@ from __future__ import annotations
 
 from typing import ClassVar
 
-import geopy.distance
 from django.http import HttpResponseBadRequest
 from rest_framework import mixins, pagination, permissions, viewsets
 from rest_framework.decorators import action
@@ -10,11 +9,13 @@ from rest_framework.response import Response
 from rest_framework.schemas.openapi import AutoSchema
 
 from olmap import models
+from olmap.rest.filters import parse_radius
 from olmap.rest.permissions import IsAuthenticatedOrNewDataPoint
 from olmap.rest.schema import SchemaWithParameters, with_parameters
 from olmap.rest.serializers import WorkplaceEntranceSerializer, WorkplaceTypeSerializer
 from olmap.rest.serializers.map_features import WorkplaceWithNoteSerializer
 from olmap.rest.serializers.workplace_wizard import EntranceSerializer, UnloadingPlaceSerializer, WorkplaceSerializer
+from olmap.spatial import within_radius
 
 
 class WorkplaceTypeViewSet(viewsets.ReadOnlyModelViewSet):
@@ -56,22 +57,24 @@ class MapFeatureViewSet(viewsets.ReadOnlyModelViewSet):
             permission_classes = [IsAuthenticatedOrNewDataPoint]
         return [permission() for permission in permission_classes]
 
-    @with_parameters(["lat", "lon"])
+    @with_parameters(["lat", "lon", "radius"], optional=["radius"])
     @action(methods=["GET"], detail=False)
     def near(self, request, *args, **kwargs):
         """
-        Return features within approximately 100m of the position passed as lat, lon in the query parameters.
+        Return features within radius meters (default 100, at most 1000) of the position passed as lat, lon in the
+        query parameters, nearest first.
         """
         lat, lon = (float(request.query_params.get(s, "0")) for s in ["lat", "lon"])
         if not (lat and lon):
             return HttpResponseBadRequest()
 
-        min_, max_ = (geopy.distance.distance(meters=100).destination((lat, lon), bearing=b) for b in (225, 45))
-        queryset = self.filter_queryset(self.get_queryset()).filter(
-            image_note__lat__gte=min_.latitude,
-            image_note__lat__lte=max_.latitude,
-            image_note__lon__gte=min_.longitude,
-            image_note__lon__lte=max_.longitude,
+        queryset = within_radius(
+            self.filter_queryset(self.get_queryset()),
+            lat,
+            lon,
+            parse_radius(request),
+            lat_field="image_note__lat",
+            lon_field="image_note__lon",
         )
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
@@ -1,10 +1,15 @@
 from __future__ import annotations
 
+import gzip
+import re
 from typing import ClassVar
 
-from django.db.models import Count, Q
+from django.http import HttpResponse, StreamingHttpResponse
+from django.middleware.gzip import re_accepts_gzip
 from django.utils import timezone
-from rest_framework import permissions, viewsets
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.generics import ListAPIView
 from rest_framework.response import Response
@@ -12,6 +17,9 @@ from rest_framework.schemas.openapi import AutoSchema
 
 from drf_jsonschema import to_jsonschema
 from olmap import models
+from olmap.rest.conditional import ConditionalListMixin
+from olmap.rest.filters import BoundingBoxFilter, ChangedSinceFilter
+from olmap.rest.geojson import point_feature, stream_feature_collection
 from olmap.rest.permissions import IsReviewer, IsReviewerOrCreator, user_is_reviewer
 from olmap.rest.schema import SchemaWithParameters
 from olmap.rest.serializers import (
@@ -20,9 +28,13 @@ from olmap.rest.serializers import (
     OSMImageNoteCommentSerializer,
     OSMImageNoteWithMapFeaturesSerializer,
 )
+from olmap.rest.serializers.osm_image_note import with_delivery_instructions
+from olmap.rest.snapshots import FullGeoJSONSnapshot
 
+re_byte_range = re.compile(r"^bytes=(\d*)-(\d*)$")
 
-class OSMImageNotesViewSet(viewsets.ModelViewSet):
+
+class OSMImageNotesViewSet(ConditionalListMixin, viewsets.ModelViewSet):
     """
     Returns OLMap image notes, i.e. map data points with associated images and map features such as entrances,
     workplaces, steps, gates etc. Note that the list representation is limited, request an individual note by ID
@@ -35,16 +47,25 @@ class OSMImageNotesViewSet(viewsets.ModelViewSet):
     permission_classes: ClassVar = [permissions.AllowAny]
     serializer_class = OSMImageNoteWithMapFeaturesSerializer
     queryset = models.OSMImageNote.objects.filter(visible=True)
+    filter_backends: ClassVar = [BoundingBoxFilter, ChangedSinceFilter]
 
     # Use simple serializer for list to improve performance:
     serializer_classes: ClassVar = {"list": DictOSMImageNoteSerializer}
+    # Actions responding with the full representation, for which to prefetch all map features:
+    full_representation_actions: ClassVar = ["retrieve", "update", "partial_update", "upvote", "downvote"]
 
     def get_queryset(self):
-        instructions_count = Count("workplace", filter=~Q(workplace__delivery_instructions=""))
-        queryset = super().get_queryset().annotate(delivery_instructions=instructions_count)
+        if self.action == "list" and self.request.query_params.get("changed_since", None):
+            # Include notes hidden since then, so that they are listed as tombstones:
+            queryset = models.OSMImageNote.objects.all()
+        else:
+            queryset = super().get_queryset()
+        queryset = with_delivery_instructions(queryset)
         if self.action == "list":
             # Fetch list as dicts rather than object instances for a bit more speed:
             return queryset.values()
+        if self.action in self.full_representation_actions:
+            return self.serializer_class.setup_eager_loading(queryset)
         return queryset
 
     def get_permissions(self):
@@ -67,6 +88,13 @@ class OSMImageNotesViewSet(viewsets.ModelViewSet):
 
         * The list representation is limited, request an individual note by ID to get a full representation.
         * **The list response may be huge**, load it only using tools efficient at handling big JSON responses.
+        * Pass bbox=min_lon,min_lat,max_lon,max_lat or a slippy map tile as z, x and y to only load the notes
+          within a map viewport.
+        * Pass changed_since=<ISO 8601 timestamp> to only load the notes modified after it, e.g. to update an
+          offline copy. Notes hidden since then are included as tombstones: {"id": ..., "visible": false, ...}.
+          Changes to the map features of a note, such as entrances and workplaces, also count as changes to the note.
+        * The response carries an ETag; pass it back as If-None-Match to get an empty 304 response if nothing has
+          changed. Last-Modified is sent for information only, If-Modified-Since does not give a 304 response.
         """
         return super().list(request, *args, **kwargs)
 
@@ -220,10 +248,13 @@ class OSMImageNoteCommentNotificationsViewSet(viewsets.ReadOnlyModelViewSet):
         return Response("OK")
 
 
-class OSMImageNotesGeoJSON(ListAPIView):
+class OSMImageNotesGeoJSON(ConditionalListMixin, ListAPIView):
     """
     Returns OLMap image notes as geojson for easy inclusion in other services.
     **Note that the response may be huge**, load it only using tools efficient at handling big JSON responses.
+    The response is streamed, so clients able to parse JSON incrementally may start processing it right away.
+    Pass bbox=min_lon,min_lat,max_lon,max_lat or a slippy map tile as z, x and y to only load a map viewport.
+    Supports conditional requests using If-None-Match; Last-Modified is sent for information only.
     Loading in Swagger UI not recommended.
     """
 
@@ -231,22 +262,54 @@ class OSMImageNotesGeoJSON(ListAPIView):
     serializer_class = DictOSMImageNoteSerializer
     queryset = models.OSMImageNote.objects.filter(visible=True).values()
     permission_classes: ClassVar = [permissions.AllowAny]
+    filter_backends: ClassVar = [BoundingBoxFilter]
 
-    def list(self, request, *args, **kwargs):
+    # Number of notes fetched at a time from the server side cursor while streaming the response:
+    chunk_size = 2000
+
+    def list_response(self, request, *args, **kwargs):
         serializer = self.get_serializer()
-        return Response(
-            {
-                "type": "FeatureCollection",
-                "features": [
-                    {
-                        "type": "Feature",
-                        "geometry": {"type": "Point", "coordinates": [note["lon"], note["lat"]]},
-                        "properties": serializer.to_representation(note),
-                    }
-                    for note in self.get_queryset()
-                ],
-            }
+        features = (
+            point_feature(note["lon"], note["lat"], serializer.to_representation(note))
+            for note in self.filter_queryset(self.get_queryset()).iterator(chunk_size=self.chunk_size)
         )
+        return StreamingHttpResponse(stream_feature_collection(features), content_type="application/json")
+
+
+def file_chunks(f, start=0, length=None, block_size=64 * 1024):
+    """
+    Yield the contents of the file-like object f in chunks, optionally limited to length bytes from start.
+    """
+    with f:
+        f.seek(start)
+        while length is None or length > 0:
+            data = f.read(block_size if length is None else min(block_size, length))
+            if not data:
+                break
+            if length is not None:
+                length -= len(data)
+            yield data
+
+
+def parse_range(header, size):
+    """
+    Return the (start, end) byte positions, end exclusive, for a single range Range header. Return None if the
+    header is missing, malformed or requests multiple ranges, in which case the whole content should be served.
+    Raise ValueError if the range cannot be satisfied.
+    """
+    match = re_byte_range.match(header or "")
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start:
+        if not end:
+            return None
+        # Suffix range, i.e. the last bytes:
+        return max(size - int(end), 0), size
+    start, end = int(start), min(int(end) + 1 if end else size, size)
+    if start >= size or start >= end:
+        raise ValueError(header)
+    return start, end
 
 
 class FullOSMImageNotesGeoJSON(ListAPIView):
@@ -254,26 +317,70 @@ class FullOSMImageNotesGeoJSON(ListAPIView):
     Returns OLMap image notes with all attached map features (entrances, workplaces etc.) as geojson.
     **Note that the response will be huge**, load it only using tools efficient at handling big JSON responses.
     Loading in Swagger UI not recommended.
-    Composing this response is resource-intensive, so only available to reviewer users.
+    Only available to reviewer users.
+
+    The response is served from a pre-rendered snapshot, which is rebuilt in the background when notes change, so it
+    may lag a little behind the latest changes. Clients accepting gzip encoding get the snapshot as is and may
+    request parts of it using Range requests, e.g. to resume an interrupted download. As the snapshot is shared by
+    all clients, translations are not supported: requests with the language parameter get a 400 response.
     """
 
     schema = AutoSchema(tags=["Image notes"], operation_id_base="geojson_full_image_note")
     serializer_class = OSMImageNoteWithMapFeaturesSerializer
     queryset = models.OSMImageNote.objects.filter(visible=True)
     permission_classes: ClassVar = [IsReviewer]
+    snapshot = FullGeoJSONSnapshot()
+    # Seconds for clients to wait before retrying when no snapshot has been built yet:
+    retry_after = 60
 
     def list(self, request, *args, **kwargs):
-        serializer = self.get_serializer()
-        return Response(
-            {
-                "type": "FeatureCollection",
-                "features": [
-                    {
-                        "type": "Feature",
-                        "geometry": {"type": "Point", "coordinates": [note.lon, note.lat]},
-                        "properties": serializer.to_representation(note),
-                    }
-                    for note in self.get_queryset()
-                ],
-            }
-        )
+        if "language" in request.query_params:
+            return Response("Translations are not available for the full geojson.", status=status.HTTP_400_BAD_REQUEST)
+        snapshot = self.snapshot.latest()
+        if snapshot is None or not self.snapshot.is_current(snapshot):
+            self.snapshot.build_in_background()
+            # Serve the previous snapshot until the new one is ready:
+            snapshot = self.snapshot.latest()
+        if snapshot is None:
+            return Response(
+                "The image notes are being rendered, please try again later.",
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": str(self.retry_after)},
+            )
+
+        gzipped = bool(re_accepts_gzip.search(request.META.get("HTTP_ACCEPT_ENCODING", "")))
+        # The gzipped and decompressed bodies are different representations, so they get different ETags:
+        etag = quote_etag(snapshot.name.rsplit("/", 1)[-1] + ("" if gzipped else "-identity"))
+        # Last-Modified has a resolution of a second, so only the ETag decides whether the snapshot has changed:
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = self.snapshot_response(request, snapshot, gzipped)
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(snapshot.built_at.timestamp())
+        patch_vary_headers(response, ["Accept-Encoding"])
+        return response
+
+    def snapshot_response(self, request, snapshot, gzipped):
+        storage = self.snapshot.storage
+        f = storage.open(snapshot.name)
+        if not gzipped:
+            return StreamingHttpResponse(file_chunks(gzip.GzipFile(fileobj=f)), content_type="application/json")
+
+        size = storage.size(snapshot.name)
+        try:
+            byte_range = parse_range(request.META.get("HTTP_RANGE", None), size)
+        except ValueError:
+            f.close()
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+        start, end = byte_range or (0, size)
+        response = StreamingHttpResponse(file_chunks(f, start, end - start), content_type="application/json")
+        if byte_range:
+            response.status_code = status.HTTP_206_PARTIAL_CONTENT
+            response["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+        response["Content-Length"] = str(end - start)
+        response["Content-Encoding"] = "gzip"
+        response["Accept-Ranges"] = "bytes"
+        return response
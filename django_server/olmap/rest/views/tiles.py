@@ -0,0 +1,128 @@
+from decimal import Decimal
+
+import mapbox_vector_tile
+from django.core.cache import cache
+from django.db.models import Avg, Count, FloatField
+from django.db.models.functions import Cast, Floor, Ln, Pi, Radians, Tan
+from django.http import HttpResponse, JsonResponse
+from django.views import View
+from rest_framework.exceptions import ValidationError
+from shapely.geometry import Point
+
+from olmap import models
+from olmap.rest.conditional import image_note_version
+from olmap.rest.filters import parse_tile
+from olmap.rest.serializers import DictOSMImageNoteSerializer
+from olmap.rest.serializers.osm_image_note import with_delivery_instructions
+from olmap.utils import tile_bounds, web_mercator
+
+
+class ImageNoteTileView(View):
+    """
+    Returns the visible image notes within a slippy map tile as a Mapbox Vector Tile. Below cluster_zoom the notes
+    are aggregated into clusters on a pixel grid, carrying the number of notes as point_count. Rendered tiles are
+    cached by a version derived from the notes within the tile, so unchanged tiles are served from the cache.
+    """
+
+    content_type = "application/vnd.mapbox-vector-tile"
+    extent = 4096
+    # Include notes this far outside the tile (in tile extent units), so that symbols crossing tile edges render:
+    buffer = 64
+    cluster_zoom = 15
+    # Number of cluster cells per tile side:
+    cluster_grid_size = 64
+    cache_timeout = 60 * 60 * 24
+
+    note_properties = ["tags", "is_reviewed", "delivery_instructions", "height"]
+
+    def get(self, request, z, x, y):
+        try:
+            z, x, y = parse_tile(z, x, y)
+        except ValidationError as e:
+            # Answered as the DRF views of the API would, the view being plain Django to serve binary tiles:
+            return JsonResponse(e.detail, status=400, safe=False)
+
+        notes = self.notes_within(models.OSMImageNote.objects.all(), *self.buffered_bounds(z, x, y))
+        cache_key = f"olmap-tile:{z}/{x}/{y}:{self.tile_version(notes)}"
+        tile = cache.get(cache_key)
+        if tile is None:
+            tile = self.render_tile(z, x, y)
+            cache.set(cache_key, tile, self.cache_timeout)
+        return HttpResponse(tile, content_type=self.content_type)
+
+    def notes_within(self, queryset, min_lon, min_lat, max_lon, max_lat):
+        return queryset.filter(lat__gte=min_lat, lat__lte=max_lat, lon__gte=min_lon, lon__lte=max_lon)
+
+    def buffered_bounds(self, z, x, y):
+        min_lon, min_lat, max_lon, max_lat = tile_bounds(z, x, y)
+        lon_buffer = (max_lon - min_lon) * self.buffer / self.extent
+        lat_buffer = (max_lat - min_lat) * self.buffer / self.extent
+        return min_lon - lon_buffer, min_lat - lat_buffer, max_lon + lon_buffer, max_lat + lat_buffer
+
+    def tile_version(self, notes):
+        count, modified_at = image_note_version(notes)
+        return f"{count}:{modified_at.timestamp() if modified_at else 0}"
+
+    def render_tile(self, z, x, y):
+        min_lon, min_lat, max_lon, max_lat = tile_bounds(z, x, y)
+        layers = [self.cluster_layer(z, x, y) if z < self.cluster_zoom else self.note_layer(z, x, y)]
+        return mapbox_vector_tile.encode(
+            layers,
+            default_options={
+                "extents": self.extent,
+                "transformer": web_mercator,
+                "quantize_bounds": web_mercator(min_lon, min_lat) + web_mercator(max_lon, max_lat),
+            },
+        )
+
+    def note_layer(self, z, x, y):
+        serializer = DictOSMImageNoteSerializer()
+        notes = self.notes_within(models.OSMImageNote.objects.filter(visible=True), *self.buffered_bounds(z, x, y))
+        return {
+            "name": "osm_image_notes",
+            "features": [
+                {
+                    "id": note["id"],
+                    "geometry": Point(float(note["lon"]), float(note["lat"])),
+                    "properties": self.note_tile_properties(serializer.to_representation(note)),
+                }
+                for note in with_delivery_instructions(notes).values()
+            ],
+        }
+
+    def note_tile_properties(self, note):
+        properties = {}
+        for key in self.note_properties:
+            value = note.get(key, None)
+            if isinstance(value, list):
+                value = ",".join(value)
+            elif isinstance(value, Decimal):
+                value = float(value)
+            if value is not None:
+                properties[key] = value
+        return properties
+
+    def cluster_layer(self, z, x, y):
+        # Group the notes by cells of a global pixel grid aligned with the tiles, so that clusters never straddle
+        # tile boundaries:
+        n = 2**z * self.cluster_grid_size
+        lon, lat = Cast("lon", FloatField()), Cast("lat", FloatField())
+        clusters = (
+            self.notes_within(models.OSMImageNote.objects.filter(visible=True), *tile_bounds(z, x, y))
+            .annotate(
+                cell_x=Floor((lon + 180) / 360 * n),
+                cell_y=Floor((1 - Ln(Tan(Pi() / 4 + Radians(lat) / 2)) / Pi()) / 2 * n),
+            )
+            .values("cell_x", "cell_y")
+            .annotate(point_count=Count("id"), avg_lat=Avg(lat), avg_lon=Avg(lon))
+        )
+        return {
+            "name": "clusters",
+            "features": [
+                {
+                    "geometry": Point(cluster["avg_lon"], cluster["avg_lat"]),
+                    "properties": {"point_count": cluster["point_count"]},
+                }
+                for cluster in clusters
+            ],
+        }
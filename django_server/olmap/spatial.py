@@ -0,0 +1,53 @@
+import math
+
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import ASin, Cast, Cos, Power, Radians, Sin, Sqrt
+
+# Mean earth radius in meters, as used by the haversine formula:
+mean_earth_radius = 6371008.8
+
+
+def bounding_box(lat, lon, radius):
+    """
+    Return (min_lat, min_lon, max_lat, max_lon) of a box containing all points within radius meters of lat, lon.
+    """
+    lat_diff = math.degrees(radius / mean_earth_radius)
+    # Widen the box for its poleward edge, where degrees of longitude are the shortest, in either hemisphere:
+    poleward_lat = min(abs(lat) + lat_diff, 90)
+    lon_diff = min(lat_diff / max(math.cos(math.radians(poleward_lat)), 1e-6), 180)
+    return lat - lat_diff, lon - lon_diff, lat + lat_diff, lon + lon_diff
+
+
+def distance_expression(lat, lon, lat_field="lat", lon_field="lon"):
+    """
+    Return an expression computing the haversine distance in meters from lat, lon to the point in the given fields.
+    """
+    row_lat = Radians(Cast(lat_field, FloatField()))
+    row_lon = Radians(Cast(lon_field, FloatField()))
+    lat, lon = Value(math.radians(lat)), Value(math.radians(lon))
+    a = Power(Sin((row_lat - lat) / 2), 2) + Cos(lat) * Cos(row_lat) * Power(Sin((row_lon - lon) / 2), 2)
+    return 2 * mean_earth_radius * ASin(Sqrt(a), output_field=FloatField())
+
+
+def within_radius(queryset, lat, lon, radius, lat_field="lat", lon_field="lon"):
+    """
+    Filter the queryset to rows within radius meters of lat, lon, annotated with their distance in meters and
+    sorted by it, nearest first.
+
+    The rows are first limited to a bounding box around the circle, which Postgres resolves using a btree index on
+    (lat, lon); only the rows within the box then get their distance computed.
+    """
+    min_lat, min_lon, max_lat, max_lon = bounding_box(lat, lon, radius)
+    return (
+        queryset.filter(
+            **{
+                f"{lat_field}__gte": min_lat,
+                f"{lat_field}__lte": max_lat,
+                f"{lon_field}__gte": min_lon,
+                f"{lon_field}__lte": max_lon,
+            }
+        )
+        .annotate(distance=distance_expression(lat, lon, lat_field, lon_field))
+        .filter(distance__lte=radius)
+        .order_by(F("distance").asc())
+    )
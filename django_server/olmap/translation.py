@@ -0,0 +1,200 @@
+import functools
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from google.cloud import translate_v2 as translate
+
+from olmap.background import run_in_background
+from olmap.models.base import Translation
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class TranslationBackend(ABC):
+    """
+    Base class for machine translation backends. Subclasses implement translate(texts, language), returning a list
+    of (translated text, detected source language) for the given list of texts.
+    """
+
+    @abstractmethod
+    def translate(self, texts, language):
+        pass
+
+
+class GoogleTranslationBackend(TranslationBackend):
+    """
+    Translates texts using Google Cloud Translation, with the service account in the given json file. The client is
+    created on first use and then reused.
+    """
+
+    def __init__(self, account_json):
+        self.account_json = account_json
+        self._client = None
+
+    def client(self):
+        if self._client is None:
+            self._client = translate.Client.from_service_account_json(self.account_json)
+        return self._client
+
+    def translate(self, texts, language):
+        result = self.client().translate(texts, target_language=language)
+        return [(r["translatedText"], r["detectedSourceLanguage"]) for r in result]
+
+
+class FakeTranslationBackend(TranslationBackend):
+    """
+    Translates texts locally by prefixing them with the target language, e.g. "Ovi" -> "[en] Ovi", for development
+    and tests without network access. Records the texts of each call in calls.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def translate(self, texts, language):
+        self.calls.append(list(texts))
+        return [(f"[{language}] {text}", "und") for text in texts]
+
+
+class TranslationCache:
+    """
+    Translates texts using the given backend, storing the translations in the Translation table and keeping the
+    size latest used in memory. Only texts translated neither in memory nor in the database are sent to the backend,
+    in a single call. lookup() only reads the stored translations, for use when serving requests, which may then
+    translate_in_background() any texts not translated yet.
+    """
+
+    def __init__(self, backend, size=10000):
+        self.backend = backend
+        self.size = size
+        self.entries = OrderedDict()
+        # (source hash, language) of the texts being translated in the background:
+        self.in_flight = set()
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def remember(self, translations):
+        with self.lock:
+            self.entries.update(translations)
+            for key in translations:
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def lookup(self, texts, language):
+        """
+        Return a list of (translated text, detected source language) for the given list of texts, with None for texts
+        not translated yet, without calling the backend.
+        """
+        keys = [(text_hash(text), language) for text in texts]
+        results = {}
+        with self.lock:
+            for key in keys:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    results[key] = self.entries[key]
+
+        missing = {source_hash for source_hash, _ in keys if (source_hash, language) not in results}
+        if missing:
+            stored = Translation.objects.filter(language=language, source_hash__in=missing)
+            found = {
+                (source_hash, language): (translated_text, source_language)
+                for source_hash, translated_text, source_language in stored.values_list(
+                    "source_hash", "translated_text", "source_language"
+                )
+            }
+            self.remember(found)
+            results.update(found)
+        return [results.get(key, None) for key in keys]
+
+    def translate(self, texts, language):
+        """
+        Return a list of (translated text, detected source language) for the given list of texts.
+        """
+        translations = self.lookup(texts, language)
+        untranslated = list(dict.fromkeys(text for text, t in zip(texts, translations, strict=True) if t is None))
+        if not untranslated:
+            return translations
+
+        translated = dict(zip(untranslated, self.backend.translate(untranslated, language), strict=True))
+        Translation.objects.bulk_create(
+            [
+                Translation(
+                    source_hash=text_hash(text),
+                    language=language,
+                    translated_text=translated_text,
+                    source_language=source_language,
+                )
+                for text, (translated_text, source_language) in translated.items()
+            ],
+            ignore_conflicts=True,
+        )
+        self.remember({(text_hash(text), language): t for text, t in translated.items()})
+        return [t or translated[text] for text, t in zip(texts, translations, strict=True)]
+
+    def translate_in_background(self, texts, language):
+        """
+        Translate the given texts in the background, except those already being translated in the background by this
+        process, e.g. for concurrent requests.
+        """
+        keys = {text: (text_hash(text), language) for text in texts}
+        with self.lock:
+            texts = [text for text, key in keys.items() if key not in self.in_flight]
+            self.in_flight.update(keys[text] for text in texts)
+        if texts:
+            run_in_background(self.translate_in_flight, texts, language)
+
+    def translate_in_flight(self, texts, language):
+        try:
+            self.translate(texts, language)
+        finally:
+            with self.lock:
+                self.in_flight.difference_update((text_hash(text), language) for text in texts)
+
+
+def get_translation_backend():
+    """
+    Return the translation backend configured in settings.TRANSLATION_BACKEND.
+    """
+    if settings.TRANSLATION_BACKEND == "google":
+        return GoogleTranslationBackend(settings.GOOGLE_ACCOUNT_JSON)
+    if settings.TRANSLATION_BACKEND == "fake":
+        return FakeTranslationBackend()
+    raise ImproperlyConfigured(f"Unknown TRANSLATION_BACKEND: {settings.TRANSLATION_BACKEND}")
+
+
+@functools.cache
+def get_translation_cache():
+    """
+    Return the translation cache of this process, created on first use from settings.
+    """
+    return TranslationCache(get_translation_backend(), settings.TRANSLATION_CACHE_SIZE)
+
+
+def pretranslate(texts, languages=None):
+    """
+    Translate the given texts into the given languages, by default settings.TRANSLATION_LANGUAGES, storing the
+    translations for lookup when serving requests.
+    """
+    cache = get_translation_cache()
+    for language in languages or settings.TRANSLATION_LANGUAGES:
+        cache.translate(texts, language)
+
+
+def pretranslate_on_commit(instances):
+    """
+    Pretranslate the translated_fields of the given model instances in the background once the current transaction
+    is committed.
+    """
+    texts = sorted({getattr(i, f) for i in instances for f in i.translated_fields if getattr(i, f)})
+    if texts and settings.TRANSLATION_LANGUAGES:
+        transaction.on_commit(lambda: run_in_background(pretranslate, texts))
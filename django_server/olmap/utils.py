@@ -1,3 +1,8 @@
+import math
+import time
+from contextlib import contextmanager
+
+
 def intersection_matches(dict1, dict2, *keys):
     for key in keys:
         if key in dict1 and key in dict2:
@@ -7,3 +12,58 @@ def intersection_matches(dict1, dict2, *keys):
             elif dict1[key] != dict2[key]:
                 return False
     return True
+
+
+def tile_bounds(z, x, y):
+    """
+    Return the bounds of the slippy map tile z/x/y as (min_lon, min_lat, max_lon, max_lat) in WGS84 degrees.
+    """
+    n = 2**z
+
+    def lon(x):
+        return x / n * 360.0 - 180.0
+
+    def lat(y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+
+    return lon(x), lat(y + 1), lon(x + 1), lat(y)
+
+
+earth_radius = 6378137.0
+
+
+def web_mercator(lon, lat):
+    """
+    Project WGS84 degrees to Web Mercator (EPSG:3857) meters, the projection used by slippy map tiles.
+    """
+    return (
+        earth_radius * math.radians(lon),
+        earth_radius * math.log(math.tan(math.pi / 4 + math.radians(lat) / 2)),
+    )
+
+
+class PhaseTimer:
+    """
+    Accumulates the wall clock time spent in named phases of a job, e.g.:
+
+        with timer.phase("fetch"):
+            ...
+    """
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0) + seconds
+
+    def merge(self, timings):
+        for name, seconds in timings.items():
+            self.add(name, seconds)
@@ -46,6 +46,8 @@ if not SECRET_KEY:
         raise ValueError("DJANGO_SECRET_KEY environment variable must be set in production")
 
 ALLOWED_HOSTS = os.environ.get("DJANGO_ALLOWED_HOSTS", "citylogistiikka.fvh.io,127.0.0.1,localhost").split(",")
+# Origin of the site, used for absolute urls in responses rendered outside of requests:
+SITE_URL = os.environ.get("DJANGO_SITE_URL", f"https://{ALLOWED_HOSTS[0]}")
 
 
 # Application definition
@@ -168,6 +170,16 @@ STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
 MEDIA_URL = "/uploads/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "uploads")
 
+# Pre-rendered responses including data visible only to reviewers, kept outside of MEDIA_ROOT so that they are not
+# served publicly:
+SNAPSHOT_ROOT = os.environ.get("SNAPSHOT_ROOT", os.path.join(BASE_DIR, "snapshots"))
+
+# OSM nodes for linking map features are read from a local extract (.osm.pbf or Overpass JSON) if OSM_EXTRACT is set,
+# otherwise queried from Overpass, caching the responses in OSM_CACHE_DIR for OSM_CACHE_TTL seconds:
+OSM_EXTRACT = os.environ.get("OSM_EXTRACT", "")
+OSM_CACHE_DIR = os.environ.get("OSM_CACHE_DIR", os.path.join(BASE_DIR, "osm_cache"))
+OSM_CACHE_TTL = int(os.environ.get("OSM_CACHE_TTL", 24 * 60 * 60))
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
         "rest_framework.authentication.TokenAuthentication",
@@ -189,6 +201,11 @@ REST_AUTH = {
     "PASSWORD_RESET_SERIALIZER": "olmap.rest.serializers.PasswordResetSerializer",
 }
 
+# Seconds to cache the group memberships of users used for permissions, or 0 to load them once per request. The cache
+# is cleared for users whose groups change, so it is only used if CACHES["default"] is shared by all processes, e.g.
+# Redis or Memcached, not the default per process LocMemCache:
+USER_GROUPS_CACHE_TTL = int(os.environ.get("USER_GROUPS_CACHE_TTL", 0))
+
 LOG_DB_QUERIES = False
 
 if LOG_DB_QUERIES:
@@ -275,6 +292,13 @@ ACCOUNT_EMAIL_VERIFICATION = "none"
 # Place a valid google account json here to enable translation of delivery instructions;
 # see https://cloud.google.com/translate/docs/setup
 GOOGLE_ACCOUNT_JSON = os.path.join(CONFIG_DIR, "google_service_account.json")
+# Translations are made by TRANSLATION_BACKEND, "google" or "fake" to translate locally without network access, e.g.
+# in development. They are stored in the database, with the TRANSLATION_CACHE_SIZE latest used kept in memory:
+TRANSLATION_BACKEND = os.environ.get("TRANSLATION_BACKEND", "google")
+TRANSLATION_CACHE_SIZE = int(os.environ.get("TRANSLATION_CACHE_SIZE", 10000))
+# Delivery instructions etc. are translated into these languages in the background when saved, as requests for
+# translations only look them up. Texts requested in other languages are translated in the background on first request:
+TRANSLATION_LANGUAGES = [lang for lang in os.environ.get("TRANSLATION_LANGUAGES", "en").split(",") if lang]
 
 try:
     from .local_settings import *  # noqa: F403
@@ -283,6 +307,7 @@ except ImportError:
 
 if "test" in sys.argv:
     DEFAULT_FILE_STORAGE = "inmemorystorage.InMemoryStorage"
+    TRANSLATION_BACKEND = "fake"
     TEST = True
     # INMEMORYSTORAGE_PERSIST = True
 else: